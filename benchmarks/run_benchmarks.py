@@ -0,0 +1,245 @@
+# Benchmarks stats.py, pre_processing.py and the helper feature functions on synthetic data and writes the
+# results as JSON, e.g.
+#   python -m benchmarks.run_benchmarks --size ci --output bench.json
+#   python -m benchmarks.run_benchmarks --size ci --baseline bench.json
+# The input paths are redirected to the synthetic data, nothing in input/ is read or written.
+import argparse
+import datetime as dt
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import generate_data
+
+SIZES = {
+    'ci': {'matches': 10000, 'players': 1000},
+    'medium': {'matches': 100000, 'players': 5000},
+    'large': {'matches': 1000000, 'players': 20000}
+}
+STATS_YEARS = {'from': 2014, 'to': 2016}
+PROC_YEARS = {'from': 2017, 'to': 2019}
+
+
+def run_benchmarks(data_dir, no_matches, no_players, no_calls=10000, repeat=3, seed=0):
+    # Generates the data if needed and times the pipeline stages and feature functions
+    if not os.path.exists(os.path.join(data_dir, 'raw')):
+        generate_data(data_dir, no_matches, no_players, {'from': STATS_YEARS['from'], 'to': PROC_YEARS['to']},
+                      seed=seed)
+
+    # The input path is read when definitions is imported, so the pipeline is imported afterwards
+    os.environ['ATP_INPUT_PATH'] = data_dir
+    from definitions import CACHE_PATH, GEN_PATH
+    from utilities import helper as h
+
+    config = h.load_config()
+    stats_filepath = os.path.join(GEN_PATH, 'bench_statistics.h5')
+    proc_match_filepath = os.path.join(GEN_PATH, 'bench_processed_matches.h5')
+    all_years = {'from': STATS_YEARS['from'], 'to': PROC_YEARS['to']}
+
+    results = {
+        'created': dt.datetime.now().isoformat(timespec='seconds'),
+        'size': {'matches': no_matches, 'players': no_players, 'calls': no_calls},
+        'environment': get_environment(),
+        'stages': {},
+        'features': {}
+    }
+    stages = results['stages']
+
+    # The first load parses the CSV files and fills the cache, later loads are served from the cache
+    shutil.rmtree(CACHE_PATH, ignore_errors=True)
+
+    for name in ['load_matches_cold', 'load_matches_warm']:
+        seconds, matches = time_call(lambda: h.load_matches(all_years))
+        stages[name] = get_throughput(seconds, len(matches))
+
+    seconds, _ = time_call(lambda: h.parse_scores(matches['score']), repeat)
+    stages['parse_scores'] = get_throughput(seconds, len(matches))
+
+    seconds, _ = time_call(lambda: h.get_match_weights(matches, config['tourney_weights'], config['base_weight'],
+                                                       config['time_decay']), repeat)
+    stages['get_match_weights'] = get_throughput(seconds, len(matches))
+
+    from stats import generate_match_statistics
+    from pre_processing import process_matches
+
+    no_stats_matches = int((matches.tourney_date.dt.year <= STATS_YEARS['to']).sum())
+    seconds, _ = time_call(lambda: generate_match_statistics(stats_filepath, config['tourney_weights'],
+                                                             config['base_weight'], STATS_YEARS, PROC_YEARS,
+                                                             config['time_decay']))
+    stages['generate_match_statistics'] = get_throughput(seconds, no_stats_matches)
+
+    if os.path.exists(proc_match_filepath + '.checkpoint'):
+        os.remove(proc_match_filepath + '.checkpoint')
+
+    seconds, _ = time_call(lambda: process_matches(stats_filepath, proc_match_filepath, config['tourney_weights'],
+                                                   config['base_weight'], PROC_YEARS, config['tourney_levels'],
+                                                   config['surfaces'], config['recent_months'], 0, False,
+                                                   config['time_decay']))
+    stages['process_matches'] = get_throughput(seconds, len(matches) - no_stats_matches)
+
+    results['features'] = run_feature_benchmarks(h, proc_match_filepath, matches, no_calls, repeat, seed)
+    return results
+
+
+def run_feature_benchmarks(h, proc_match_filepath, matches, no_calls, repeat, seed):
+    # Times the feature functions of the pre-processing loop on the state after process_matches
+    from utilities.ranking_index import RankingIndex
+    from utilities.tourney_resolver import TourneyResolver
+
+    with open(proc_match_filepath + '.state', 'rb') as f:
+        store = pickle.load(f)['feature_store']
+
+    store.ranking_index = RankingIndex(h.load_rankings())
+
+    if store.resolver is None:
+        store.resolver = TourneyResolver()
+
+    store.add_players(h.load_players())
+
+    rng = np.random.default_rng(seed)
+    sample = matches.iloc[rng.integers(0, len(matches), no_calls)]
+    sample = list(zip(sample.winner_id, sample.loser_id, sample.surface.map(h.get_surface), sample.tourney_id,
+                      sample.tourney_date, sample.tourney_name, sample.winner_ioc, sample.loser_ioc))
+    codes = [(store.get_code(w), store.get_code(l)) for w, l, *_ in sample]
+    cond_stats = store.cond_stats
+    climate = 'tempered'
+
+    benchmarks = {
+        'get_relative_total_wins':
+            lambda: [h.get_relative_total_wins(cond_stats, w, l) for w, l in codes],
+        'get_relative_surface_wins':
+            lambda: [h.get_relative_surface_wins(cond_stats, w, l, m[2]) for (w, l), m in zip(codes, sample)],
+        'get_relative_climate_wins':
+            lambda: [h.get_relative_climate_wins(cond_stats, w, l, climate) for w, l in codes],
+        'get_mutual_surface_wins':
+            lambda: [h.get_mutual_surface_wins(store.mutual_matches_clay, store.mutual_matches_grass,
+                                               store.mutual_matches_hard, m[2], w, l)
+                     for (w, l), m in zip(codes, sample)],
+        'get_recent_performance':
+            lambda: [h.get_recent_performance(m[0], m[1], store.recent_form, m[3]) for m in sample],
+        'get_tourney_games':
+            lambda: [h.get_tourney_games(m[0], m[1], store.tourney_games, m[3]) for m in sample],
+        'get_home_advantage':
+            lambda: [h.get_home_advantage(m[6], m[7], 'USA') for m in sample],
+        'get_rankings':
+            lambda: [h.get_rankings(store.ranking_index, m[0], m[1], m[4]) for m in sample],
+        'get_time_weight':
+            lambda: [h.get_time_weight(m[4], store.time_decay) for m in sample],
+        'feature_store.features':
+            lambda: [store.features(m[0], m[1], m[4], m[5], m[2]) for m in sample]
+    }
+
+    features = {}
+
+    for name, benchmark in benchmarks.items():
+        seconds, _ = time_call(benchmark, repeat)
+        features[name] = {
+            'calls': no_calls,
+            'seconds': seconds,
+            'calls_per_second': no_calls / seconds,
+            'us_per_call': seconds / no_calls * 1e6
+        }
+
+    return features
+
+
+def time_call(f, repeat=1):
+    # Best wall time of a number of runs and the result of the last run
+    best = None
+    result = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    return best, result
+
+
+def get_throughput(seconds, no_matches):
+    return {'matches': no_matches, 'seconds': seconds, 'matches_per_second': no_matches / seconds}
+
+
+def get_environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Prints the change against a baseline run and returns the benchmarks that got slower than the tolerance
+    regressions = []
+    print('{:<30} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current', 'ratio'))
+
+    for group in ['stages', 'features']:
+        for name, result in results[group].items():
+            if name not in baseline.get(group, {}):
+                continue
+
+            ratio = result['seconds'] / baseline[group][name]['seconds']
+            print('{:<30} {:>11.4f}s {:>11.4f}s {:>8.2f}'.format(name, baseline[group][name]['seconds'],
+                                                                  result['seconds'], ratio))
+
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+
+    return regressions
+
+
+def print_results(results):
+    for name, result in results['stages'].items():
+        print('{:<30} {:>10.3f}s {:>12.0f} matches/s'.format(name, result['seconds'], result['matches_per_second']))
+
+    for name, result in results['features'].items():
+        print('{:<30} {:>10.2f}us {:>12.0f} calls/s'.format(name, result['us_per_call'], result['calls_per_second']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the pipeline on synthetic data')
+    parser.add_argument('--size', choices=list(SIZES), default='ci')
+    parser.add_argument('--matches', type=int, help='number of matches, overrides the size')
+    parser.add_argument('--players', type=int, help='number of players, overrides the size')
+    parser.add_argument('--calls', type=int, default=10000, help='calls per feature function')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of the fast benchmarks, the best is kept')
+    parser.add_argument('--data-dir', help='directory of the synthetic data, generated if missing')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slow down against the baseline')
+    args = parser.parse_args()
+
+    no_matches = args.matches or SIZES[args.size]['matches']
+    no_players = args.players or SIZES[args.size]['players']
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='atp_bench_')
+
+    results = run_benchmarks(data_dir, no_matches, no_players, args.calls, args.repeat)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        print('Results saved to', args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        if len(regressions) > 0:
+            print('Slower than the baseline:', ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# Generates synthetic match, ranking, player and tourney files with the ATP schema (input/raw and input/generated)
+import os
+import string
+import numpy as np
+import pandas as pd
+
+MATCH_FILE_COLUMNS = ['tourney_id', 'tourney_name', 'surface', 'draw_size', 'tourney_level', 'tourney_date',
+                      'match_num', 'winner_id', 'winner_seed', 'winner_entry', 'winner_name', 'winner_hand',
+                      'winner_ht', 'winner_ioc', 'winner_age', 'winner_rank', 'winner_rank_points', 'loser_id',
+                      'loser_seed', 'loser_entry', 'loser_name', 'loser_hand', 'loser_ht', 'loser_ioc', 'loser_age',
+                      'loser_rank', 'loser_rank_points', 'score', 'best_of', 'round', 'minutes']
+
+# Levels per match file, weighted by how often they are played
+FILE_LEVELS = {
+    'atp_matches_futures_': (['S'], [1]),
+    'atp_matches_qual_chall_': (['C'], [1]),
+    'atp_matches_': (['A', 'M', 'G', 'D', 'F'], [0.6, 0.2, 0.1, 0.08, 0.02])
+}
+FILE_SHARES = [0.4, 0.35, 0.25]
+SURFACES = ['Hard', 'Clay', 'Grass', 'Carpet']
+SURFACE_SHARES = [0.5, 0.35, 0.1, 0.05]
+CLIMATES = ['tempered', 'tropical_dry']
+MATCHES_PER_TOURNEY = 31
+
+
+def generate_data(path, no_matches=10000, no_players=1000, years=None, no_tourneys=200, no_countries=40,
+                  no_ranked=2000, seed=0):
+    # Writes all files needed by stats.py and pre_processing.py to path/raw and path/generated,
+    # the matches are spread evenly over the years
+    if years is None:
+        years = {'from': 2014, 'to': 2019}
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(path, 'raw'), exist_ok=True)
+    os.makedirs(os.path.join(path, 'generated'), exist_ok=True)
+
+    countries = get_country_codes(rng, no_countries)
+    tourneys = generate_tourneys(rng, no_tourneys, countries)
+    players = generate_players(rng, no_players, countries, years)
+    matches = generate_matches(rng, no_matches, players, tourneys, years)
+    rankings = generate_rankings(rng, players, years, no_ranked)
+
+    tourneys.to_csv(os.path.join(path, 'generated', 'tourneys_fixed.csv'))
+    players.drop(columns=['strength'], errors='ignore').to_csv(os.path.join(path, 'raw', 'atp_players.csv'),
+                                                               index=False)
+
+    for (prefix, year), year_matches in matches.groupby(['file', 'year']):
+        year_matches = year_matches.drop(columns=['file', 'year'])
+        year_matches.to_csv(os.path.join(path, 'raw', prefix + str(year) + '.csv'), index=False)
+
+    # Rankings are split like the real files, the last year goes to the current file
+    last_year = rankings.ranking_date // 10000 == years['to']
+    rankings[~last_year].to_csv(os.path.join(path, 'raw', 'atp_rankings_10s.csv'), index=False)
+    rankings[last_year].to_csv(os.path.join(path, 'raw', 'atp_rankings_current.csv'), index=False)
+
+    print('Synthetic data generated:', len(matches), 'matches,', len(players), 'players,', len(rankings), 'rankings')
+    return matches
+
+
+def get_country_codes(rng, no_countries):
+    letters = np.array(list(string.ascii_uppercase))
+    codes = set()
+
+    while len(codes) < no_countries:
+        codes.add(''.join(rng.choice(letters, 3)))
+
+    return sorted(codes)
+
+
+def get_words(rng, no_words, length=8):
+    # Lowercase letter only words, so that tourney names survive helper.filter_tourney_name
+    letters = np.array(list(string.ascii_lowercase))
+    words = set()
+
+    while len(words) < no_words:
+        words.add(''.join(rng.choice(letters, length)))
+
+    return sorted(words)
+
+
+def generate_tourneys(rng, no_tourneys, countries):
+    # Same layout as tourneys_fixed.csv, one location per tourney
+    locations = get_words(rng, no_tourneys)
+    country_codes = rng.choice(countries, no_tourneys)
+
+    return pd.DataFrame({
+        'country_name': country_codes,
+        'location': locations,
+        'country_code': country_codes,
+        'climate': rng.choice(CLIMATES, no_tourneys, p=[0.7, 0.3])
+    })
+
+
+def generate_players(rng, no_players, countries, years):
+    birth_years = rng.integers(years['from'] - 35, years['to'] - 16, no_players)
+    birthdates = birth_years * 10000 + rng.integers(1, 13, no_players) * 100 + rng.integers(1, 29, no_players)
+    names = get_words(rng, no_players, 10)
+
+    return pd.DataFrame({
+        'player_id': 100000 + np.arange(no_players),
+        'firstname': [name[:4].capitalize() for name in names],
+        'lastname': [name[4:].capitalize() for name in names],
+        'hand': rng.choice(['R', 'L'], no_players, p=[0.85, 0.15]),
+        'birthdate': birthdates,
+        'country': rng.choice(countries, no_players),
+        'strength': rng.normal(0, 1, no_players)
+    })
+
+
+def generate_scores(rng, no_scores=500):
+    # A pool of best of three scores with tiebreaks, match tiebreaks and retirements
+    won_sets = np.array(['6-0', '6-1', '6-2', '6-3', '6-4', '7-5', '7-6'])
+    scores = []
+
+    for _ in range(no_scores):
+        sets = list(rng.choice(won_sets, 2 + int(rng.random() < 0.35)))
+
+        # In three sets the loser won the first or the second set
+        if len(sets) == 3:
+            lost = rng.integers(0, 2)
+            sets[lost] = sets[lost][::-1]
+
+        sets = [s + '(' + str(rng.integers(0, 10)) + ')' if s in ['7-6', '6-7'] else s for s in sets]
+
+        if rng.random() < 0.03:
+            sets = sets[:1] + ['RET']
+        elif len(sets) == 3 and rng.random() < 0.1:
+            sets[2] = '[10-' + str(rng.integers(0, 9)) + ']'
+
+        scores.append(' '.join(sets))
+
+    return np.array(scores)
+
+
+def generate_matches(rng, no_matches, players, tourneys, years):
+    # Tourneys of 31 matches on weekly dates, winners are drawn by player strength
+    no_events = int(np.ceil(no_matches / MATCHES_PER_TOURNEY))
+    mondays = pd.date_range(str(years['from']) + '-01-01', str(years['to']) + '-12-31', freq='W-MON')
+    event_dates = np.sort(rng.choice(mondays.to_numpy(), no_events))
+    event_files = rng.choice(list(FILE_LEVELS), no_events, p=FILE_SHARES)
+    event_levels = np.array([rng.choice(FILE_LEVELS[f][0], p=FILE_LEVELS[f][1]) for f in event_files])
+    event_tourneys = rng.integers(0, len(tourneys), no_events)
+    event_surfaces = rng.choice(SURFACES, no_events, p=SURFACE_SHARES)
+
+    events = np.repeat(np.arange(no_events), MATCHES_PER_TOURNEY)[:no_matches]
+    match_nums = np.tile(np.arange(1, MATCHES_PER_TOURNEY + 1), no_events)[:no_matches]
+
+    # Two different players per match
+    no_players = len(players)
+    player_1 = rng.integers(0, no_players, no_matches)
+    player_2 = (player_1 + rng.integers(1, no_players, no_matches)) % no_players
+    strength = players['strength'].to_numpy()
+    p_1_wins = 1 / (1 + np.exp(strength[player_2] - strength[player_1]))
+    p_1_won = rng.random(no_matches) < p_1_wins
+    winners = np.where(p_1_won, player_1, player_2)
+    losers = np.where(p_1_won, player_2, player_1)
+
+    dates = pd.DatetimeIndex(event_dates[events])
+    birthdates = pd.to_datetime(players['birthdate'].astype(str), format='%Y%m%d').to_numpy()
+    winner_ages = (dates.to_numpy() - birthdates[winners]) / np.timedelta64(1, 'D') / 365.25
+    loser_ages = (dates.to_numpy() - birthdates[losers]) / np.timedelta64(1, 'D') / 365.25
+    names = (players['firstname'] + ' ' + players['lastname']).to_numpy()
+    ioc = players['country'].to_numpy()
+    event_years = event_dates.astype('datetime64[Y]').astype(int) + 1970
+
+    matches = pd.DataFrame({
+        'tourney_id': [str(event_years[e]) + '-' + str(e) for e in events],
+        'tourney_name': [tourneys.location[t].capitalize() for t in event_tourneys[events]],
+        'surface': event_surfaces[events],
+        'draw_size': 32,
+        'tourney_level': event_levels[events],
+        'tourney_date': dates.strftime('%Y%m%d'),
+        'match_num': match_nums,
+        'winner_id': players['player_id'].to_numpy()[winners],
+        'winner_seed': np.nan,
+        'winner_entry': np.nan,
+        'winner_name': names[winners],
+        'winner_hand': players['hand'].to_numpy()[winners],
+        'winner_ht': np.nan,
+        'winner_ioc': ioc[winners],
+        'winner_age': winner_ages,
+        'winner_rank': np.nan,
+        'winner_rank_points': np.nan,
+        'loser_id': players['player_id'].to_numpy()[losers],
+        'loser_seed': np.nan,
+        'loser_entry': np.nan,
+        'loser_name': names[losers],
+        'loser_hand': players['hand'].to_numpy()[losers],
+        'loser_ht': np.nan,
+        'loser_ioc': ioc[losers],
+        'loser_age': loser_ages,
+        'loser_rank': np.nan,
+        'loser_rank_points': np.nan,
+        'score': rng.choice(generate_scores(rng), no_matches),
+        'best_of': 3,
+        'round': 'R32',
+        'minutes': rng.integers(50, 200, no_matches)
+    }, columns=MATCH_FILE_COLUMNS)
+
+    matches['file'] = event_files[events]
+    matches['year'] = event_years[events]
+    return matches
+
+
+def generate_rankings(rng, players, years, no_ranked=2000):
+    # Weekly rankings of the best players by a slowly changing strength, points fall off with the rank
+    mondays = pd.date_range(str(years['from'] - 1) + '-01-01', str(years['to']) + '-12-31', freq='W-MON')
+    strength = players['strength'].to_numpy()
+    player_ids = players['player_id'].to_numpy()
+    no_players = len(players)
+    no_ranked = min(no_ranked, no_players)
+    ranks = np.arange(1, no_ranked + 1)
+    rankings = []
+
+    for date in mondays:
+        strength = strength + rng.normal(0, 0.05, no_players)
+        order = np.argsort(-strength)[:no_ranked]
+        rankings.append(pd.DataFrame({
+            'ranking_date': int(date.strftime('%Y%m%d')),
+            'rank': ranks,
+            'player': player_ids[order],
+            'points': np.round(10000 / np.sqrt(ranks)).astype(np.int64)
+        }))
+
+    return pd.concat(rankings, ignore_index=True)
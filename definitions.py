@@ -1,6 +1,10 @@
 import os
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-GEN_PATH = os.path.join(ROOT_DIR, 'input/generated/')
-RAW_PATH = os.path.join(ROOT_DIR, 'input/raw/')
-ODDS_PATH = os.path.join(ROOT_DIR, 'input/odds/')
+
+# The input directory can be moved with ATP_INPUT_PATH, e.g. to run the benchmarks on synthetic data
+INPUT_PATH = os.environ.get('ATP_INPUT_PATH', os.path.join(ROOT_DIR, 'input'))
+GEN_PATH = os.path.join(INPUT_PATH, 'generated/')
+RAW_PATH = os.path.join(INPUT_PATH, 'raw/')
+ODDS_PATH = os.path.join(INPUT_PATH, 'odds/')
+CACHE_PATH = os.path.join(INPUT_PATH, 'cache/')
@@ -1,29 +1,44 @@
-import json
 import os
 
-from definitions import GEN_PATH, ROOT_DIR
+from definitions import GEN_PATH
+from odds_merge import merge_odds
 from stats import generate_match_statistics
 from pre_processing import process_matches
+from utilities import helper as h
+from utilities.instrumentation import Profiler
 
-# Read configuration file
-with open(os.path.join(ROOT_DIR, 'config.json')) as f:
-    config = json.load(f)
+# Read configuration file, with defaults for the settings it does not have
+config = h.load_config()
 
 stats_filepath = os.path.join(GEN_PATH, config['stats_filename'])
 proc_match_filepath = os.path.join(GEN_PATH, config['proc_match_filename'])
+odds_filepath = os.path.join(GEN_PATH, config['odds_filename'])
 base_weight = config['base_weight']
+time_decay = config['time_decay']
 t_weights = config['tourney_weights']
 t_levels = config['tourney_levels']
 surfaces = config['surfaces']
 stats_years = config['stats_year']
 proc_years = config['proc_year']
+recent_months = config['recent_months']
+checkpoint_every = config['checkpoint_every']
+append_training = config['append_training']
 
 # GENERATE STATISTICS
 # - create new statistical data to be used for training
 if config['generate_stats']:
-    generate_match_statistics(stats_filepath, t_weights, base_weight, stats_years, proc_years)
+    profiler = Profiler('generate_match_statistics', **config['instrumentation'])
+    generate_match_statistics(stats_filepath, t_weights, base_weight, stats_years, proc_years, time_decay, profiler)
 
 # FEATURE ENGINEERING
 # - generate new features to be evaluated
 if config['generate_training']:
-    process_matches(stats_filepath, proc_match_filepath, t_weights, base_weight, proc_years, t_levels, surfaces)
+    profiler = Profiler('process_matches', **config['instrumentation'])
+    process_matches(stats_filepath, proc_match_filepath, t_weights, base_weight, proc_years, t_levels, surfaces,
+                    recent_months, checkpoint_every, append_training, time_decay, profiler)
+
+# HISTORIC ODDS
+# - merge the bookmaker odds of the processed years with the ATP player ids
+if config['merge_odds']:
+    profiler = Profiler('merge_odds', **config['instrumentation'])
+    merge_odds(odds_filepath, proc_years, profiler)
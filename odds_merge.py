@@ -0,0 +1,47 @@
+import os
+import numpy as np
+
+from utilities import helper as h
+from utilities import odds as o
+from utilities.hdf_store import write_table, ODDS_DATA_COLUMNS
+from utilities.instrumentation import Profiler
+from utilities.player_names import PlayerNameIndex
+
+
+def merge_odds(odds_filepath, years, profiler=None):
+    # Computes the best and average bookmaker odds of all matches in the odds files and merges them with the
+    # ATP player ids, matches where a player can not be resolved are dropped
+    print('----- MERGING HISTORIC ODDS -----')
+
+    if profiler is None:
+        profiler = Profiler('merge_odds')
+
+    with profiler.stage('load_odds'):
+        odds = o.load_odds(years)
+
+    with profiler.stage('calc_odds'):
+        odds = o.prune_odds(o.calc_odds(o.clean_odds(odds)))
+
+    # Players active in the period are preferred when a name fits several players
+    with profiler.stage('load_matches'):
+        matches = h.load_matches(years)
+        active_ids = np.unique(np.append(matches.winner_id.to_numpy(), matches.loser_id.to_numpy()))
+
+    with profiler.stage('load_players'):
+        name_index = PlayerNameIndex(h.load_player_names(), active_ids)
+
+    with profiler.stage('merge_player_ids'):
+        odds = o.merge_player_ids(odds, name_index, matches)
+        odds = odds.dropna()
+
+    with profiler.stage('write_hdf'):
+        write_table(odds, odds_filepath, 'odds', ODDS_DATA_COLUMNS, mode='w')
+
+    print('H5 odds file saved')
+
+    profiler.set_processed(len(odds))
+    profiler.print_summary()
+    profiler.save(os.path.splitext(odds_filepath)[0] + '_report.json')
+
+    time_diff = round(profiler.elapsed())
+    print('----- ODDS MERGE COMPLETED, EXEC TIME:', time_diff, 'SECONDS ----- \n')
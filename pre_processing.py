@@ -1,209 +1,237 @@
 import os
-import time
+import pickle
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
 
-from definitions import GEN_PATH
 from utilities import helper as h
+from utilities.feature_store import FeatureStore, FEATURE_COLUMNS
+from utilities.hdf_store import write_table, MATCH_DATA_COLUMNS
+from utilities.instrumentation import Profiler
+from utilities.ranking_index import RankingIndex
+from utilities.schema import DATA_COLUMNS, COLS_NOT_SCALE, PROCESSED_SCHEMA, apply_schema
+from utilities.tourney_resolver import TourneyResolver
 
+FLOAT_COLUMNS = ['points_grad_diff', 'rel_tourney_games', 'age_diff']
 
-def process_matches(stats_filepath, proc_match_filepath, t_weights, base_weight, proc_years, t_levels, surfaces):
+
+def process_matches(stats_filepath, proc_match_filepath, t_weights, base_weight, proc_years, t_levels, surfaces,
+                    recent_months=3, checkpoint_every=10000, append=False, time_decay=None, profiler=None):
     # Generates a match matrix with certain statistics for each match
+    # In append mode, only matches newer than the last processed match are processed and appended
     print('----- GENERATING PRE-PROCESSED MATCHES -----')
-    start_time = time.time()
 
-    mutual_matches_clay = pd.read_hdf(stats_filepath, key='mm_clay')
-    mutual_matches_grass = pd.read_hdf(stats_filepath, key='mm_grass')
-    mutual_matches_hard = pd.read_hdf(stats_filepath, key='mm_hard')
-    mutual_matches = mutual_matches_clay + mutual_matches_grass + mutual_matches_hard
-    mutual_score = pd.read_hdf(stats_filepath, key='ms')
-    cond_stats = pd.read_hdf(stats_filepath, key='cs')
-    print('Generated statistics loaded')
+    if profiler is None:
+        profiler = Profiler('process_matches')
+
+    state_filepath = proc_match_filepath + '.state'
+    checkpoint_filepath = proc_match_filepath + '.checkpoint'
 
-    # Load rankings
-    rankings = h.load_rankings()
+    # Load rankings and index them by player and date
+    with profiler.stage('load_rankings'):
+        ranking_index = RankingIndex(h.load_rankings())
 
     # Load raw_matches and sport by date
     print('Loading raw matches...')
-    raw_matches = h.load_matches(proc_years)
-    raw_matches.sort_values(by=['tourney_date'], inplace=True, ascending=True)
 
-    # Load last years matches to calculate recent performance for matches in january
-    last_year = proc_years['from'] - 1
-    recent_years = {
-        'from': last_year,
-        'to': last_year
-    }
+    with profiler.stage('load_matches'):
+        raw_matches = h.load_matches(proc_years)
+        raw_matches.sort_values(by=['tourney_date'], inplace=True, ascending=True, kind='mergesort')
 
-    current_tourney_date = raw_matches.iloc[0].tourney_date
-    month_offset = 3
-    date_limit = current_tourney_date - pd.DateOffset(months=month_offset)
+    if append:
+        with profiler.stage('load_state'):
+            state = load_state(state_filepath)
 
-    print('Loading recent matches...')
-    recent_matches = h.load_matches(recent_years)
-    recent_matches = recent_matches.loc[recent_matches.tourney_date >= date_limit]
+        raw_matches = raw_matches.loc[raw_matches.tourney_date > state['last_date']]
+        state['no_processed'] = 0
+        print('Appending matches after', state['last_date'].date())
+    else:
+        state = None
 
-    # Load tournament details
-    tourneys = pd.read_csv(os.path.join(GEN_PATH, 'tourneys_fixed.csv'), index_col=0)
+    no_matches = len(raw_matches)
 
-    data_columns = ['tourney_date', 'rel_total_wins', 'rel_surface_wins', 'mutual_wins', 'mutual_surface_wins',
-                    'mutual_games', 'rank_diff', 'points_grad_diff', 'home_advantage', 'rel_climate_wins',
-                    'rel_recent_wins', 'rel_tourney_games', 'tourney_level', 'player_1', 'player_2', 'surface',
-                    'age_diff', 'outcome']
-    matches = np.zeros((len(raw_matches), len(data_columns)), dtype=np.int64)
-    matches = pd.DataFrame(matches, columns=data_columns)
+    if no_matches == 0:
+        print('No new matches to process')
+        return
 
-    i = 0
-    no_matches = len(raw_matches)
+    with profiler.stage('resolve_tourneys'):
+        TourneyResolver().add_columns(raw_matches)
+
+    # Look up the rankings for all matches at once
+    with profiler.stage('rankings'):
+        rank_diffs, points_grad_diffs = ranking_index.get_rankings(raw_matches.winner_id, raw_matches.loser_id,
+                                                                   raw_matches.tourney_date)
+
+    # A checkpoint is only resumed for the exact same matches, parameters and statistics file
+    stats_stat = os.stat(stats_filepath)
+    run_time_decay = h.load_config()['time_decay'] if time_decay is None else time_decay
+    run_key = (append, no_matches, raw_matches.iloc[0].tourney_date, raw_matches.iloc[-1].tourney_date,
+               t_weights, base_weight, recent_months, run_time_decay, stats_stat.st_mtime_ns, stats_stat.st_size)
+
+    with profiler.stage('load_state'):
+        checkpoint = load_state(checkpoint_filepath) if os.path.exists(checkpoint_filepath) else None
+
+    if checkpoint is not None and checkpoint['run_key'] == run_key:
+        state = checkpoint
+        print('Resuming from checkpoint,', state['no_processed'], 'matches already processed')
+    elif state is None:
+        with profiler.stage('init_state'):
+            state = init_state(stats_filepath, t_weights, base_weight, proc_years, recent_months, time_decay,
+                               raw_matches.iloc[0].tourney_date)
+
+    state['run_key'] = run_key
+
+    # Typed column buffers of this run, restored from the checkpoint when resuming. Features are kept at full
+    # precision until they are scaled, the written file uses the compact PROCESSED_SCHEMA.
+    columns = {column: np.zeros(no_matches, dtype=np.float64 if column in FLOAT_COLUMNS else np.int32)
+               for column in DATA_COLUMNS}
+    columns['tourney_date'] = np.zeros(no_matches, dtype=np.int64)
+
+    if state['no_processed'] > 0:
+        for column, values in state['matches'].items():
+            columns[column][:len(values)] = values
+
+    match_surfaces = raw_matches['surface'].map(h.get_surface).to_numpy()
+    feature_store = state['feature_store']
+
+    # Statistics update weights of all matches, the loop only indexes into them
+    with profiler.stage('match_weights'):
+        match_weights = list(zip(*h.get_match_weights(raw_matches, t_weights, base_weight,
+                                                      feature_store.time_decay)))
+
+    i = state['no_processed']
 
     print('Pre-processing matches...')
 
     # Generate training matrix and update statistics matrices
     # Loop unavoidable
-    for raw_match in raw_matches.itertuples():
-        match = matches.iloc[i].copy()
-        winner_id = raw_match.winner_id
-        loser_id = raw_match.loser_id
-        tourney_date = raw_match.tourney_date
-        time_weight = h.get_time_weight(tourney_date)
-        surface = h.get_surface(raw_match.surface)
-        location = h.filter_tourney_name(raw_match.tourney_name)
-        climate = tourneys.loc[tourneys.location == location, 'climate']
-
-        if len(climate) > 0:
-            climate = climate.iloc[0]
-        else:
-            # If climate unknown, assume tempered (maybe indoor)
-            climate = 'tempered'
-
-        # Update recent matches where tournament date is strictly larger one month ago
-        if tourney_date > current_tourney_date:
-            current_tourney_date = tourney_date
-            date_limit = current_tourney_date - pd.DateOffset(months=month_offset)
-            recent_matches = recent_matches.loc[recent_matches.tourney_date >= date_limit]
-
-        # 1. Relative total win raw_matches differences
-        rel_total_wins = h.get_relative_total_wins(cond_stats, winner_id, loser_id)
-        match.rel_total_wins = round(base_weight * rel_total_wins)
-
-        # 2. Relative surface win differences
-        rel_surface_wins = h.get_relative_surface_wins(cond_stats, winner_id, loser_id, surface)
-        match.rel_surface_wins = round(base_weight * rel_surface_wins)
-
-        # 3. Mutual wins
-        mutual_wins = mutual_matches[winner_id][loser_id] - mutual_matches[loser_id][winner_id]
-        match.mutual_wins = mutual_wins
-
-        # 4. Mutual surface wins
-        mutual_surface_wins = h.get_mutual_surface_wins(mutual_matches_clay, mutual_matches_grass, mutual_matches_hard,
-                                                        surface, winner_id, loser_id)
-        match.mutual_surface_wins = mutual_surface_wins
-
-        # 4. Mutual game
-        mutual_games = mutual_score[winner_id][loser_id] - mutual_score[loser_id][winner_id]
-        match.mutual_games = mutual_games
-
-        # 5. Rank diff
-        rank_diff, points_grad_diff = h.get_rankings(rankings, winner_id, loser_id, tourney_date)
-        match.rank_diff = rank_diff
-        match.points_grad_diff = points_grad_diff
-
-        # 6. Home advantage
-        home_advantage = h.get_home_advantage(raw_match.winner_ioc, raw_match.loser_ioc, tourneys,
-                                              raw_match.tourney_name)
-        match.home_advantage = home_advantage
-
-        # 7. Relative climate win differences
-        rel_climate_wins = h.get_relative_climate_wins(cond_stats, winner_id, loser_id, climate)
-        match.rel_climate_wins = round(base_weight * rel_climate_wins)
-
-        # 8. Get recent wins
-        rel_recent_wins = h.get_recent_performance(winner_id, loser_id, recent_matches, tourney_date)
-        match.rel_recent_wins = round(base_weight * rel_recent_wins)
-
-        # 9. Get tournament performance in games
-        tourney_id = raw_match.tourney_id
-        match_num = raw_match.match_num
-        rel_tourney_games = h.get_tourney_games(winner_id, loser_id, recent_matches, tourney_id, match_num)
-        match.rel_tourney_games = rel_tourney_games
-
-        # 10. Set age difference
-        match.age_diff = raw_match.winner_age - raw_match.loser_age
-
-        # 11. Winner is always winner
-        match.outcome = 1
-
-        # Create a balanced set with equal outcomes
-        if i % 2 == 0:
-            try:
-                # An error here occured once and I am not sure why
-                match = -match
-            except TypeError:
-                print(match)
-
-        # 12. Set non numeric stuff after balancing set
-        # Set the date as unix time so the store is more efficient (integer)
-        match.tourney_date = int(tourney_date.timestamp())
-        match.player_1 = winner_id
-        match.player_2 = loser_id
-        match.tourney_level = t_levels[raw_match.tourney_level]
-        match.surface = surfaces[surface]
-
-        # Update entry
-        matches.iloc[i] = match
-
-        # Add current match to recent matches
-        # noinspection PyProtectedMember
-        raw_match_df = pd.DataFrame.from_records([raw_match], columns=raw_match._fields, exclude=['Index'])
-        recent_matches = recent_matches.append(pd.DataFrame(raw_match_df))
-
-        # Update stats matrices
-        match_d_weight = round(base_weight * time_weight)
-        match_dt_weight = round(base_weight * time_weight * t_weights[raw_match.tourney_level])
-
-        cond_stats['total_wins'][winner_id] += match_dt_weight
-        cond_stats['surface_' + surface + '_wins'][winner_id] += match_d_weight
-        cond_stats['climate_' + climate + '_wins'][winner_id] += match_d_weight
-        cond_stats['total_losses'][loser_id] += match_dt_weight
-        cond_stats['surface_' + surface + '_losses'][loser_id] += match_d_weight
-        cond_stats['climate_' + climate + '_losses'][loser_id] += match_d_weight
-
-        # Update mutual stats
-        mutual_matches[winner_id][loser_id] += match_d_weight
-
-        # Extract win on surface
-        if surface == 'clay':
-            mutual_matches_clay[winner_id][loser_id] += match_d_weight
-        elif surface == 'grass':
-            mutual_matches_grass[winner_id][loser_id] += match_d_weight
-        else:
-            mutual_matches_hard[winner_id][loser_id] += match_d_weight
-
-        try:
-            winner_games, loser_games = h.get_score(raw_match.score)
-        except ValueError:
-            winner_games = 0
-            loser_games = 0
-
-        mutual_score[winner_id][loser_id] += round(base_weight * time_weight * winner_games)
-        mutual_score[loser_id][winner_id] += round(base_weight * time_weight * loser_games)
-
-        # Update counter
-        i += 1
-        h.print_progress(i, no_matches)
+    profiler.start_loop(no_matches, i)
+
+    with profiler.stage('match_loop'):
+        for raw_match in raw_matches.iloc[i:].itertuples():
+            profiler.sample(i)
+            tourney_date = raw_match.tourney_date
+
+            # Update recent matches where tournament date is strictly larger one month ago
+            feature_store.advance(tourney_date, raw_match.match_num)
+            profiler.lap('advance')
+
+            # Features seen from the winner, the rankings are already looked up for all matches
+            home_advantage = h.get_home_advantage(raw_match.winner_ioc, raw_match.loser_ioc, raw_match.country_code)
+            age_diff = raw_match.winner_age - raw_match.loser_age
+            profiler.lap('home_advantage_age_diff')
+
+            features = feature_store.get_features(raw_match.winner_id, raw_match.loser_id, raw_match.tourney_id,
+                                                  match_surfaces[i], raw_match.climate, rank_diffs[i],
+                                                  points_grad_diffs[i], home_advantage, age_diff, profiler)
+
+            for column, value in features.items():
+                columns[column][i] = value
+
+            profiler.lap('write_row')
+
+            # Add the result to the statistics
+            feature_store.update(raw_match, match_weights[i])
+            profiler.lap('update')
+
+            # Update counter
+            i += 1
+            state['last_date'] = tourney_date
+            profiler.progress(i)
+
+            # Save everything needed to resume from here
+            if checkpoint_every and i % checkpoint_every == 0 and i < no_matches:
+                with profiler.stage('save_checkpoint'):
+                    state['no_processed'] = i
+                    state['matches'] = {column: values[:i].copy() for column, values in columns.items()}
+                    save_state(state, checkpoint_filepath)
+
+                print('Checkpoint saved after', i, 'matches')
 
     print('All', no_matches, 'matches (100%) processed')
 
-    cols_not_scale = ['tourney_date', 'home_advantage', 'tourney_level', 'player_1', 'player_2', 'surface', 'outcome']
-    matches_not_scale = matches.filter(cols_not_scale, axis=1)
-    matches_scale = matches.drop(cols_not_scale, axis=1)
-    matches_scale[matches_scale.columns] = StandardScaler().fit_transform(matches_scale[matches_scale.columns])
-    matches = matches_scale.join(matches_not_scale)
-    matches.to_hdf(proc_match_filepath, key='matches', mode='w')
+    with profiler.stage('balance'):
+        # Winner is always winner
+        columns['outcome'][:] = 1
+
+        # Create a balanced set with equal outcomes by flipping every other match, parity continues over appends
+        flip = (state['total_processed'] + np.arange(no_matches)) % 2 == 0
+
+        for column in FEATURE_COLUMNS + ['outcome']:
+            columns[column][flip] = -columns[column][flip]
+
+        # Set non numeric stuff after balancing set
+        # Set the date as unix time so the store is more efficient (integer)
+        columns['tourney_date'][:] = raw_matches['tourney_date'].to_numpy().astype('datetime64[s]').astype(np.int64)
+        columns['player_1'][:] = raw_matches['winner_id'].to_numpy()
+        columns['player_2'][:] = raw_matches['loser_id'].to_numpy()
+        columns['tourney_level'][:] = raw_matches['tourney_level'].map(t_levels).to_numpy()
+        columns['surface'][:] = [surfaces[surface] for surface in match_surfaces]
+
+    with profiler.stage('scale'):
+        matches = pd.DataFrame(columns, columns=DATA_COLUMNS)
+
+        matches_not_scale = matches.filter(COLS_NOT_SCALE, axis=1)
+        matches_scale = matches.drop(COLS_NOT_SCALE, axis=1).astype(np.float64)
+
+        # Appended matches are scaled like the matches already in the file
+        if not append:
+            state['scaler'] = StandardScaler().fit(matches_scale)
+
+        matches_scale[matches_scale.columns] = state['scaler'].transform(matches_scale)
+        matches = apply_schema(matches_scale.join(matches_not_scale), PROCESSED_SCHEMA)
+        matches.index = pd.RangeIndex(state['total_processed'], state['total_processed'] + no_matches)
+
+    # Compressed table with indexed data columns, new matches are appended without rewriting the file
+    with profiler.stage('write_hdf'):
+        write_table(matches, proc_match_filepath, 'matches', MATCH_DATA_COLUMNS, append=append, mode='w')
 
     print('Pre-processed H5 matches saved')
 
-    end_time = time.time()
-    time_diff = round(end_time - start_time)
+    # Keep the final state for appending new matches later
+    with profiler.stage('save_state'):
+        state['total_processed'] += no_matches
+        state['no_processed'] = 0
+        state['matches'] = None
+        save_state(state, state_filepath)
+
+    if os.path.exists(checkpoint_filepath):
+        os.remove(checkpoint_filepath)
+
+    profiler.print_summary()
+    profiler.save(os.path.splitext(proc_match_filepath)[0] + '_report.json')
+
+    time_diff = round(profiler.elapsed())
     print('----- PRE-PROCESS COMPLETED, EXEC TIME:', time_diff, 'SECONDS ----- \n')
+
+
+def init_state(stats_filepath, t_weights, base_weight, proc_years, recent_months, time_decay, first_date):
+    # Creates the state of a new run from the generated statistics and last years matches
+    feature_store = FeatureStore.from_stats(stats_filepath, t_weights, base_weight, recent_months, time_decay)
+
+    # Load last years matches to calculate recent performance for matches in january
+    feature_store.add_recent_matches(proc_years['from'] - 1, first_date)
+
+    return {
+        'feature_store': feature_store,
+        'no_processed': 0,
+        'total_processed': 0,
+        'last_date': None,
+        'matches': None,
+        'scaler': None
+    }
+
+
+def save_state(state, filepath):
+    # Pickle to a temporary file first so that a crash while saving keeps the previous state
+    tmp_filepath = filepath + '.tmp'
+
+    with open(tmp_filepath, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(tmp_filepath, filepath)
+
+
+def load_state(filepath):
+    with open(filepath, 'rb') as f:
+        return pickle.load(f)
@@ -1,118 +1,105 @@
 import os
-import time
-import pandas as pd
 import numpy as np
 
-from definitions import GEN_PATH
 from utilities import helper as h
+from utilities.hdf_store import write_table
+from utilities.instrumentation import Profiler
+from utilities.player_stats import PlayerIndex, HeadToHeadStore, ConditionalStats
+from utilities.schema import STATS_DTYPE
+from utilities.tourney_resolver import TourneyResolver
 
 
-def generate_match_statistics(filepath, t_weights, base_weight, stats_years, proc_years):
+def generate_match_statistics(filepath, t_weights, base_weight, stats_years, proc_years, time_decay=None,
+                              profiler=None):
     # Generates match statistics matrices for a certain time period
     print('----- GENERATING MATCH STATISTICS -----')
-    start_time = time.time()
+
+    if profiler is None:
+        profiler = Profiler('generate_match_statistics')
 
     # Load players
-    player_ids = h.extract_player_ids(proc_years)
-    no_players = len(player_ids)
+    with profiler.stage('load_players'):
+        player_index = PlayerIndex(h.extract_player_ids(proc_years))
+        no_players = len(player_index)
 
     # Load matches to generate statistics
-    matches = h.load_matches(stats_years, player_ids)
-    no_matches = len(matches)
+    with profiler.stage('load_matches'):
+        matches = h.load_matches(stats_years, player_index.ids)
+        no_matches = len(matches)
 
-    # Create mutual stats matrices
-    base_matrix = np.zeros((no_players, no_players), dtype=np.int64)
-    mutual_matches_clay = pd.DataFrame(base_matrix, player_ids, player_ids)
-    mutual_matches_grass = pd.DataFrame(base_matrix, player_ids, player_ids)
-    mutual_matches_hard = pd.DataFrame(base_matrix, player_ids, player_ids)
-    mutual_score = pd.DataFrame(base_matrix, player_ids, player_ids)
+    # Add tournament details
+    with profiler.stage('resolve_tourneys'):
+        TourneyResolver().add_columns(matches)
 
-    # Create general perfomance matrix
-    cond_cat = ['total_wins', 'total_losses', 'surface_clay_wins', 'surface_clay_losses', 'surface_grass_wins',
-                'surface_grass_losses', 'surface_hard_wins', 'surface_hard_losses', 'climate_tropical_dry_wins',
-                'climate_tropical_dry_losses', 'climate_tempered_wins', 'climate_tempered_losses']
-    cond_stats = np.zeros((no_players, len(cond_cat)), dtype=np.int64)
-    cond_stats = pd.DataFrame(cond_stats, player_ids, cond_cat)
+    print('Generating match statistics...')
 
-    # Load tournament details
-    tourneys = pd.read_csv(os.path.join(GEN_PATH, 'tourneys_fixed.csv'), index_col=0)
+    with profiler.stage('match_weights'):
+        # Map players to integer codes
+        winner_codes, winner_in_ids = player_index.get_codes(matches.winner_id.to_numpy())
+        loser_codes, loser_in_ids = player_index.get_codes(matches.loser_id.to_numpy())
+        mutual_in_ids = winner_in_ids & loser_in_ids
 
-    # Counter for timing purposes
-    i = 0
+        # Calculate match weights for all matches at once
+        match_d_weights, match_dt_weights, winner_games_weights, loser_games_weights = h.get_match_weights(
+            matches, t_weights, base_weight, time_decay)
 
-    print('Generating match statistics...')
+        surfaces = matches['surface'].map(h.get_surface).to_numpy()
+        climates = matches.climate.to_numpy()
 
-    # Loop is unavoidable...
-    for match in matches.itertuples():
-        winner_id = match.winner_id
-        loser_id = match.loser_id
-        time_weight = h.get_time_weight(match.tourney_date)
-        surface = h.get_surface(match.surface)
-        location = h.filter_tourney_name(match.tourney_name)
-        climate = tourneys.loc[tourneys.location == location, 'climate']
-
-        if len(climate) > 0:
-            climate = climate.iloc[0]
-        else:
-            # If climate unknown, assume tempered (maybe indoor)
-            climate = 'tempered'
-
-        # Calculate match weights
-        match_d_weight = round(base_weight * time_weight)
-        match_dt_weight = round(base_weight * time_weight * t_weights[match.tourney_level])
-
-        # Check flags
-        winner_in_ids = False
-        loser_in_ids = False
-
-        # Winner stats
-        if winner_id in player_ids:
-            cond_stats['total_wins'][winner_id] += match_dt_weight
-            cond_stats['surface_' + surface + '_wins'][winner_id] += match_d_weight
-            cond_stats['climate_' + climate + '_wins'][winner_id] += match_d_weight
-            winner_in_ids = True
-
-        # Loser stats
-        if loser_id in player_ids:
-            cond_stats['total_losses'][loser_id] += match_dt_weight
-            cond_stats['surface_' + surface + '_losses'][loser_id] += match_d_weight
-            cond_stats['climate_' + climate + '_losses'][loser_id] += match_d_weight
-            loser_in_ids = True
-
-        # Mutual statistics
-        if winner_in_ids and loser_in_ids:
-            # Extract win on surface
-            if surface == 'clay':
-                mutual_matches_clay[winner_id][loser_id] += match_d_weight
-            elif surface == 'grass':
-                mutual_matches_grass[winner_id][loser_id] += match_d_weight
-            else:
-                mutual_matches_hard[winner_id][loser_id] += match_d_weight
-
-            try:
-                winner_games, loser_games = h.get_score(match.score)
-            except ValueError:
-                winner_games = 0
-                loser_games = 0
-
-            mutual_score[winner_id][loser_id] += round(base_weight * time_weight * winner_games)
-            mutual_score[loser_id][winner_id] += round(base_weight * time_weight * loser_games)
-
-        # Update counter
-        i += 1
-        h.print_progress(i, no_matches)
+    # Create general perfomance matrix
+    with profiler.stage('conditional_stats'):
+        cond_stats = ConditionalStats(no_players)
+        cond_stats.add_many('total_wins', winner_codes[winner_in_ids], match_dt_weights[winner_in_ids])
+        cond_stats.add_many('total_losses', loser_codes[loser_in_ids], match_dt_weights[loser_in_ids])
+
+        for surface in ['clay', 'grass', 'hard']:
+            winner_mask = winner_in_ids & (surfaces == surface)
+            loser_mask = loser_in_ids & (surfaces == surface)
+            cond_stats.add_many('surface_' + surface + '_wins', winner_codes[winner_mask],
+                                match_d_weights[winner_mask])
+            cond_stats.add_many('surface_' + surface + '_losses', loser_codes[loser_mask],
+                                match_d_weights[loser_mask])
+
+        for climate in ['tropical_dry', 'tempered']:
+            winner_mask = winner_in_ids & (climates == climate)
+            loser_mask = loser_in_ids & (climates == climate)
+            cond_stats.add_many('climate_' + climate + '_wins', winner_codes[winner_mask],
+                                match_d_weights[winner_mask])
+            cond_stats.add_many('climate_' + climate + '_losses', loser_codes[loser_mask],
+                                match_d_weights[loser_mask])
+
+    # Mutual statistics
+    with profiler.stage('mutual_stats'):
+        mutual_winners = winner_codes[mutual_in_ids]
+        mutual_losers = loser_codes[mutual_in_ids]
+        mutual_surfaces = surfaces[mutual_in_ids]
+        mutual_d_weights = match_d_weights[mutual_in_ids]
+        mutual_matches = {}
+
+        for surface in ['clay', 'grass', 'hard']:
+            mask = mutual_surfaces == surface
+            mutual_matches[surface] = HeadToHeadStore()
+            mutual_matches[surface].add_many(mutual_winners[mask], mutual_losers[mask], mutual_d_weights[mask])
+
+        mutual_score = HeadToHeadStore()
+        mutual_score.add_many(mutual_winners, mutual_losers, winner_games_weights[mutual_in_ids])
+        mutual_score.add_many(mutual_losers, mutual_winners, loser_games_weights[mutual_in_ids])
 
     print('All', no_matches, 'matches (100%) processed')
 
     # To avoid running script every training phase
-    mutual_matches_clay.to_hdf(filepath, key='mm_clay', mode='w')
-    mutual_matches_grass.to_hdf(filepath, key='mm_grass')
-    mutual_matches_hard.to_hdf(filepath, key='mm_hard')
-    mutual_score.to_hdf(filepath, key='ms')
-    cond_stats.to_hdf(filepath, key='cs')
+    with profiler.stage('write_hdf'):
+        write_table(cond_stats.to_frame(player_index).astype(STATS_DTYPE), filepath, 'cs', mode='w')
+        mutual_matches['clay'].to_hdf(filepath, 'mm_clay', player_index)
+        mutual_matches['grass'].to_hdf(filepath, 'mm_grass', player_index)
+        mutual_matches['hard'].to_hdf(filepath, 'mm_hard', player_index)
+        mutual_score.to_hdf(filepath, 'ms', player_index)
 
     print('H5 statistics file saved')
 
-    end_time = time.time()
-    time_diff = round(end_time - start_time)
+    profiler.set_processed(no_matches)
+    profiler.print_summary()
+    profiler.save(os.path.splitext(filepath)[0] + '_report.json')
+
+    time_diff = round(profiler.elapsed())
     print('----- MATCH STATISTICS COMPLETED, EXEC TIME:', time_diff, 'SECONDS ----- \n')
@@ -0,0 +1,6 @@
+# The pipeline reads its input path when definitions is imported, so the tests point it to a temporary
+# directory for synthetic data before any test module imports the pipeline
+import os
+import tempfile
+
+os.environ['ATP_INPUT_PATH'] = tempfile.mkdtemp(prefix='atp_tests_')
@@ -0,0 +1,92 @@
+# Replays the processed years through FeatureStore.features and update and compares the features with the
+# rows written by process_matches, on a small synthetic data set
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import generate_data
+from definitions import INPUT_PATH, GEN_PATH
+from pre_processing import process_matches
+from stats import generate_match_statistics
+from utilities import helper as h
+from utilities.feature_store import FeatureStore, FEATURE_COLUMNS
+from utilities.ranking_index import RankingIndex
+from utilities.tourney_resolver import TourneyResolver
+
+STATS_YEARS = {'from': 2017, 'to': 2017}
+PROC_YEARS = {'from': 2018, 'to': 2019}
+
+
+@pytest.fixture(scope='module')
+def processed():
+    # Statistics and processed matches of the synthetic data, with the processed rows seen from the winner
+    # and not scaled
+    generate_data(INPUT_PATH, no_matches=4000, no_players=300, years={'from': 2016, 'to': 2019},
+                  no_tourneys=2000, seed=1)
+    config = h.load_config()
+    stats_filepath = os.path.join(GEN_PATH, 'test_statistics.h5')
+    proc_match_filepath = os.path.join(GEN_PATH, 'test_processed_matches.h5')
+
+    generate_match_statistics(stats_filepath, config['tourney_weights'], config['base_weight'], STATS_YEARS,
+                              PROC_YEARS, config['time_decay'])
+    process_matches(stats_filepath, proc_match_filepath, config['tourney_weights'], config['base_weight'],
+                    PROC_YEARS, config['tourney_levels'], config['surfaces'], config['recent_months'], 0, False,
+                    config['time_decay'])
+
+    with open(proc_match_filepath + '.state', 'rb') as f:
+        scaler = pickle.load(f)['scaler']
+
+    rows = pd.read_hdf(proc_match_filepath, key='matches')
+    scaled = list(scaler.feature_names_in_)
+    rows[scaled] = scaler.inverse_transform(rows[scaled].astype(np.float64))
+
+    # Balanced rows have the features negated
+    flipped = rows['outcome'].to_numpy() == -1
+    rows.loc[flipped, FEATURE_COLUMNS] = -rows.loc[flipped, FEATURE_COLUMNS]
+    return stats_filepath, config, rows
+
+
+def test_features_agree_with_process_matches(processed):
+    stats_filepath, config, rows = processed
+
+    store = FeatureStore.from_stats(stats_filepath, config['tourney_weights'], config['base_weight'],
+                                    config['recent_months'], config['time_decay'])
+    store.ranking_index = RankingIndex(h.load_rankings())
+    store.resolver = TourneyResolver()
+
+    matches = h.load_matches(PROC_YEARS)
+    matches.sort_values(by=['tourney_date'], inplace=True, ascending=True, kind='mergesort')
+    store.resolver.add_columns(matches)
+    store.add_recent_matches(PROC_YEARS['from'] - 1, matches.iloc[0].tourney_date)
+
+    # Tournament ids are only resolved by name and date, the fixture must not have two tournaments with the
+    # same name starting on the same date
+    assert matches.groupby(['tourney_name', 'tourney_date'], observed=True)['tourney_id'].nunique().max() == 1
+
+    match_weights = list(zip(*h.get_match_weights(matches, config['tourney_weights'], config['base_weight'],
+                                                  store.time_decay)))
+    features = []
+    known = []
+
+    for i, match in enumerate(matches.itertuples()):
+        # Country and age of a player are only known to the store after the first match of the player
+        known.append(match.winner_id in store.players and match.loser_id in store.players)
+        features.append(store.features(match.winner_id, match.loser_id, match.tourney_date, match.tourney_name,
+                                       match.surface, match_num=match.match_num))
+        store.update(match, match_weights[i])
+
+    features = pd.DataFrame(features, columns=FEATURE_COLUMNS, index=rows.index)
+    known = np.array(known)
+    assert len(features) == len(rows) and known.mean() > 0.5
+
+    for column in FEATURE_COLUMNS:
+        expected = rows[column].to_numpy(dtype=np.float64)
+        actual = features[column].to_numpy(dtype=np.float64)
+
+        if column in ['home_advantage', 'age_diff']:
+            expected = expected[known]
+            actual = actual[known]
+
+        assert np.allclose(actual, expected, rtol=1e-4, atol=1e-3, equal_nan=True), column
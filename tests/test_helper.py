@@ -0,0 +1,62 @@
+# Helper functions: score parsing on the notations of the ATP files (tiebreak points, match tiebreaks, two digit
+# final sets, retirements, walkovers and missing scores), match weights and the config defaults
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+from utilities import helper as h
+
+# Score, the games of every set seen from the winner and if the match was completed
+SCORES = [
+    ('7-6(5) 6-7(3) 7-6(10)', [(7, 6), (6, 7), (7, 6)], True),
+    ('6-4 3-6 [10-8]', [(6, 4), (3, 6), (1, 0)], True),
+    ('6-4 6-7(5) 7-6(10) 3-6 10-8', [(6, 4), (6, 7), (7, 6), (3, 6), (10, 8)], True),
+    ('6-3 2-1 RET', [(6, 3), (2, 1)], False),
+    ('6-2 3-3 DEF', [(6, 2), (3, 3)], False),
+    ('W/O', [], False),
+    (np.nan, [], False)
+]
+
+
+@pytest.mark.parametrize('score, sets, completed', SCORES)
+def test_parse_scores(score, sets, completed):
+    winner_games, loser_games, is_completed = h.parse_scores(pd.Series([score], dtype=object))
+
+    assert winner_games[0] == sum(games for games, _ in sets)
+    assert loser_games[0] == sum(games for _, games in sets)
+    assert is_completed[0] == completed
+
+
+@pytest.mark.parametrize('dtype', [object, 'category'])
+def test_parse_scores_repeated(dtype):
+    # Distinct scores are parsed once and mapped back to every row in order, load_matches gives a categorical
+    scores = pd.Series([score for score, _, _ in SCORES] * 3, dtype=dtype).sample(frac=1, random_state=0)
+    winner_games, loser_games, completed = h.parse_scores(scores)
+
+    expected = {str(score): (sum(w for w, _ in sets), sum(l for _, l in sets), done) for score, sets, done in SCORES}
+    assert [expected[str(score)] for score in scores] == list(zip(winner_games, loser_games, completed))
+
+
+def test_get_match_weights_unknown_level():
+    # A level without a tourney weight fails instead of getting a meaningless weight
+    matches = pd.DataFrame({'tourney_date': pd.to_datetime(['2018-01-01', '2018-01-08']), 'tourney_level': ['G', 'X'],
+                            'winner_games': [18, 12], 'loser_games': [12, 4]})
+
+    with pytest.raises(KeyError, match='X'):
+        h.get_match_weights(matches, {'G': 1.0, 'M': 0.9}, 1000)
+
+    weights = h.get_match_weights(matches.iloc[:1], {'G': 1.0, 'M': 0.9}, 1000)
+    assert weights[0][0] == weights[1][0] > 0
+
+
+def test_load_config_defaults(tmp_path, monkeypatch):
+    # A config.json from before the new settings gets their defaults, a partial dict is completed
+    config = {'base_weight': 100, 'time_decay': {'years': 2}}
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    monkeypatch.setattr(h, 'ROOT_DIR', str(tmp_path))
+
+    loaded = h.load_config()
+    assert loaded['base_weight'] == 100
+    assert loaded['time_decay'] == {**h.CONFIG_DEFAULTS['time_decay'], 'years': 2}
+    assert all(key in loaded for key in h.CONFIG_DEFAULTS)
@@ -0,0 +1,160 @@
+# Walk-forward backtest on the processed matches. process_matches advances the statistics once in date order and
+# stores the features of every match as they were before it was played, so each period is predicted by a model
+# fitted (or updated) only on the matches before the period, without generating the statistics again.
+# The features in the file are standardized with the mean and deviation of all processed years, so they are
+# turned back with the scaler of process_matches and standardized again with the training matches of every period.
+import pickle
+import warnings
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, log_loss
+from sklearn.preprocessing import StandardScaler
+
+from utilities.odds import attach_odds
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def get_periods(dates, period='month'):
+    # Period of every unix time date, 'tourney' groups the tournaments starting on the same date
+    dates = np.asarray(dates, dtype=np.int64).astype('datetime64[s]')
+
+    if period == 'month':
+        return dates.astype('datetime64[M]')
+    elif period == 'week':
+        # Weeks starting on monday, the 5th of january 1970 was a monday
+        days = dates.astype('datetime64[D]').astype(np.int64)
+        return (days - (days - 4) % 7).astype('datetime64[D]')
+    elif period == 'tourney':
+        return dates.astype('datetime64[D]')
+    else:
+        raise ValueError('Unknown backtest period: ' + period)
+
+
+def load_scaler(proc_match_filepath):
+    # Scaler of the processed matches, kept in the state file by process_matches
+    with open(proc_match_filepath + '.state', 'rb') as f:
+        return pickle.load(f)['scaler']
+
+
+def unscale(X, features, scaler):
+    # Features as they were before process_matches standardized them, returns the mask of the scaled columns
+    names = list(scaler.feature_names_in_)
+    scaled = np.array([feature in names for feature in features], dtype=bool)
+    columns = [names.index(feature) for feature in np.asarray(features)[scaled]]
+
+    X = X.copy()
+    X[:, scaled] = X[:, scaled] * scaler.scale_[columns] + scaler.mean_[columns]
+    return X, scaled
+
+
+def rescale(X, scaled, scaler):
+    # Standardizes the scaled columns with the scaler of the training matches, as they are without a scaler
+    if scaler is None:
+        return X
+
+    X = X.copy()
+    X[:, scaled] = scaler.transform(X[:, scaled])
+    return X
+
+
+def walk_forward(matches, model, features, scaler, period='month', min_train=10000, window_days=None, update=False,
+                 odds=None, rolling=3):
+    # Predicts every period after the first min_train matches with a model fitted on the matches before it,
+    # only on the last window_days if given. With update, the model is fitted once and then updated with
+    # partial_fit on the matches of every period, e.g. an SGDClassifier.
+    # The scaler is the one of process_matches (load_scaler), the features are standardized again with the
+    # training matches of every period (of the first fit with update). With scaler=None the features are used as
+    # they are, for processed matches that leaks the scaling of the later periods into the earlier ones.
+    # With odds, the return of a unit bet on the predicted winner is reported as well.
+    # Returns the metrics per period and the prediction of every tested match.
+    matches = matches.sort_values(by=['tourney_date'], kind='mergesort')
+
+    if odds is not None:
+        matches = attach_odds(matches, odds)
+
+    X = matches[features].to_numpy(dtype=np.float64)
+    y = matches['outcome'].to_numpy()
+    dates = matches['tourney_date'].to_numpy(dtype=np.int64)
+    labels = get_periods(dates, period)
+
+    scaled = None
+
+    if scaler is None:
+        warnings.warn('walk_forward without the scaler of process_matches uses features scaled with later periods')
+    else:
+        X, scaled = unscale(X, features, scaler)
+
+    starts = np.flatnonzero(np.append(True, labels[1:] != labels[:-1]))
+    ends = np.append(starts[1:], len(labels))
+
+    predictions = np.full(len(y), np.nan)
+    probabilities = np.full(len(y), np.nan)
+    fitted = None
+    train_scaler = None
+    fitted_until = 0
+    rows = []
+
+    for start, end in zip(starts, ends):
+        if start < min_train:
+            continue
+
+        if update and fitted is not None:
+            fitted.partial_fit(rescale(X[fitted_until:start], scaled, train_scaler), y[fitted_until:start])
+        else:
+            train_start = 0 if window_days is None else np.searchsorted(dates, dates[start] -
+                                                                        window_days * SECONDS_PER_DAY)
+            if scaler is not None:
+                train_scaler = StandardScaler().fit(X[train_start:start, scaled])
+
+            fitted = clone(model).fit(rescale(X[train_start:start], scaled, train_scaler), y[train_start:start])
+
+        fitted_until = start
+        X_test = rescale(X[start:end], scaled, train_scaler)
+        predictions[start:end] = fitted.predict(X_test)
+
+        row = {
+            'period': labels[start],
+            'no_train': start,
+            'no_test': end - start,
+            'accuracy': accuracy_score(y[start:end], predictions[start:end]),
+            'log_loss': np.nan
+        }
+
+        # Probability of outcome 1, the player seen from winning
+        if hasattr(fitted, 'predict_proba'):
+            proba = fitted.predict_proba(X_test)
+            probabilities[start:end] = proba[:, list(fitted.classes_).index(1)]
+            row['log_loss'] = log_loss(y[start:end], proba, labels=fitted.classes_)
+
+        rows.append(row)
+
+    tested = ~np.isnan(predictions)
+    results = pd.DataFrame({
+        'period': labels,
+        'prediction': predictions,
+        'probability': probabilities,
+        'correct': predictions == y
+    }, index=matches.index).loc[tested]
+
+    periods = pd.DataFrame(rows, columns=['period', 'no_train', 'no_test', 'accuracy', 'log_loss'])
+
+    if odds is not None:
+        # Unit bets on the predicted winner of every match with odds
+        won = results['correct'].to_numpy()
+        bet_odds = np.where(won, matches['max_winner'].to_numpy()[tested], matches['max_loser'].to_numpy()[tested])
+        results['bet_return'] = np.where(won, bet_odds, 0) - 1
+        results.loc[np.isnan(bet_odds), 'bet_return'] = np.nan
+
+        bets = results.groupby('period')['bet_return'].agg(['count', 'mean'])
+        periods['no_bets'] = periods['period'].map(bets['count']).fillna(0).astype(np.int64)
+        periods['roi'] = periods['period'].map(bets['mean'])
+
+    # Rolling and cumulative accuracy weighted by the matches of each period
+    correct = periods['accuracy'] * periods['no_test']
+    periods['rolling_accuracy'] = (correct.rolling(rolling, min_periods=1).sum() /
+                                   periods['no_test'].rolling(rolling, min_periods=1).sum())
+    periods['cumulative_accuracy'] = correct.cumsum() / periods['no_test'].cumsum()
+
+    return periods.set_index('period'), results
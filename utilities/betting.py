@@ -0,0 +1,136 @@
+# Betting backtests on matches with model probabilities and bookmaker odds. A strategy bets a fraction of the
+# wallet on every match, so the wallet after each match is the cumulative product of the match growth factors.
+# Bootstrap resamples of the matches give distributions of the final wallet, drawdown and ruin.
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Default parameters of the strategies, e.g. {'strategy': 'kelly', 'multiplier': 0.25}
+STRATEGIES = {
+    'flat': {'fraction': 0.02},
+    'kelly': {'multiplier': 0.5, 'max_fraction': 0.1},
+    'threshold': {'fraction': 0.02, 'threshold': 0.6}
+}
+
+
+def get_bet_fractions(strategy, probabilities, odds):
+    # Fraction of the wallet bet on each match, probabilities and odds are those of the player bet on
+    params = dict(STRATEGIES[strategy['strategy']], **strategy)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    odds = np.asarray(odds, dtype=np.float64)
+
+    if params['strategy'] == 'flat':
+        return np.full(len(odds), params['fraction'])
+    elif params['strategy'] == 'kelly':
+        # Kelly fraction (p * o - 1) / (o - 1), no bet without an edge
+        kelly = (probabilities * odds - 1) / np.maximum(odds - 1, 1e-9)
+        return np.clip(params['multiplier'] * kelly, 0, params['max_fraction'])
+    elif params['strategy'] == 'threshold':
+        return np.where(probabilities >= params['threshold'], params['fraction'], 0)
+    else:
+        raise ValueError('Unknown betting strategy: ' + params['strategy'])
+
+
+def get_orders(no_matches, no_resamples, seed=0):
+    # Bootstrap resamples of the matches, the first row is the actual order
+    rng = np.random.default_rng(seed)
+    orders = rng.integers(0, no_matches, (no_resamples, no_matches))
+    orders[0] = np.arange(no_matches)
+    return orders
+
+
+def simulate_wallets(fractions, odds, won, initial_wallet=100, orders=None):
+    # Wallet after each match for every order of the matches, shape (orders, matches)
+    growth = 1 + np.asarray(fractions) * (np.where(won, odds, 0) - 1)
+
+    if orders is None:
+        orders = np.arange(len(growth))[np.newaxis, :]
+
+    return initial_wallet * np.cumprod(growth[orders], axis=1)
+
+
+def get_max_drawdowns(wallets, initial_wallet=100):
+    # Largest relative fall from a previous high, the initial wallet included
+    highs = np.maximum(np.maximum.accumulate(wallets, axis=1), initial_wallet)
+    return (1 - wallets / highs).max(axis=1)
+
+
+def get_losing_streaks(wallets, fractions, won, initial_wallet=100):
+    # Longest run of lost bets and the largest amount lost in a run, matches without a bet do not end a run
+    fractions = np.broadcast_to(fractions, wallets.shape)
+    won = np.broadcast_to(won, wallets.shape)
+    previous = np.concatenate([np.full((len(wallets), 1), float(initial_wallet)), wallets[:, :-1]], axis=1)
+    lost = (fractions > 0) & ~won
+    reset = (fractions > 0) & won
+
+    # Running totals minus their value at the last won bet
+    lost_count = np.cumsum(lost, axis=1)
+    lost_amount = np.cumsum(np.where(lost, previous * fractions, 0), axis=1)
+    streak = lost_count - np.maximum.accumulate(np.where(reset, lost_count, 0), axis=1)
+    streak_amount = lost_amount - np.maximum.accumulate(np.where(reset, lost_amount, 0), axis=1)
+
+    return streak.max(axis=1), streak_amount.max(axis=1)
+
+
+def simulate_strategy(strategy, probabilities, odds, won, orders, initial_wallet=100, ruin_level=0.1,
+                      chunk_size=250):
+    # Distributions of one strategy over all orders, computed in chunks of orders to limit the memory use
+    fractions = get_bet_fractions(strategy, probabilities, odds)
+    won = np.asarray(won, dtype=bool)
+    results = {'final_wallet': [], 'max_drawdown': [], 'ruined': [], 'max_losing_streak': [], 'no_bets': []}
+
+    for start in range(0, len(orders), chunk_size):
+        chunk = orders[start:start + chunk_size]
+        wallets = simulate_wallets(fractions, odds, won, initial_wallet, chunk)
+        max_streak, _ = get_losing_streaks(wallets, fractions[chunk], won[chunk], initial_wallet)
+
+        results['final_wallet'].append(wallets[:, -1])
+        results['max_drawdown'].append(get_max_drawdowns(wallets, initial_wallet))
+        results['ruined'].append(wallets.min(axis=1) < ruin_level * initial_wallet)
+        results['max_losing_streak'].append(max_streak)
+        results['no_bets'].append((fractions[chunk] > 0).sum(axis=1))
+
+    return {name: np.concatenate(values) for name, values in results.items()}
+
+
+def simulate_strategies(strategies, probabilities, odds, won, no_resamples=1000, initial_wallet=100,
+                        ruin_level=0.1, seed=0, workers=1):
+    # Simulates all strategies on the same bootstrap resamples, optionally one strategy per process
+    # Returns a summary table with one row per strategy and the distributions of every strategy
+    odds = np.asarray(odds, dtype=np.float64)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    orders = get_orders(len(odds), no_resamples, seed)
+    args = (probabilities, odds, won, orders, initial_wallet, ruin_level)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(simulate_strategy, strategy, *args) for strategy in strategies]
+            distributions = [future.result() for future in futures]
+    else:
+        distributions = [simulate_strategy(strategy, *args) for strategy in strategies]
+
+    names = [get_strategy_name(strategy) for strategy in strategies]
+    summary = pd.DataFrame([summarize(d, initial_wallet) for d in distributions], index=names)
+    return summary, dict(zip(names, distributions))
+
+
+def summarize(distribution, initial_wallet=100):
+    returns = distribution['final_wallet'] / initial_wallet - 1
+
+    return {
+        'actual_return': returns[0],
+        'mean_return': returns.mean(),
+        'median_return': np.median(returns),
+        'p5_return': np.percentile(returns, 5),
+        'p95_return': np.percentile(returns, 95),
+        'mean_max_drawdown': distribution['max_drawdown'].mean(),
+        'p95_max_drawdown': np.percentile(distribution['max_drawdown'], 95),
+        'ruin_probability': distribution['ruined'].mean(),
+        'mean_max_losing_streak': distribution['max_losing_streak'].mean(),
+        'mean_bets': distribution['no_bets'].mean()
+    }
+
+
+def get_strategy_name(strategy):
+    params = ', '.join(k + '=' + str(v) for k, v in strategy.items() if k != 'strategy')
+    return strategy['strategy'] + ('(' + params + ')' if params else '')
@@ -0,0 +1,127 @@
+# Typed columnar cache of the raw CSV and Excel files. Every column is stored as a memory-mappable NumPy file,
+# string columns as integer codes plus their distinct values. A cache entry is rebuilt when the source file changes.
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from definitions import CACHE_PATH
+
+MANIFEST = 'manifest.json'
+
+
+def read_csv_cached(filepath, parse_dates=None, columns=None, years=None, categories=None):
+    # Reads a CSV through the cache, optionally only some columns and only rows where the first date column
+    # falls in a year range, e.g. years = {'from': 2010, 'to': 2019}
+    # String columns listed in categories are returned as categoricals straight from the stored codes
+    cache_dir = os.path.join(CACHE_PATH, os.path.splitext(os.path.basename(filepath))[0])
+    manifest = read_manifest(cache_dir, filepath)
+
+    if manifest is None:
+        manifest = write_cache(filepath, cache_dir, parse_dates)
+
+    stored = {column['name']: column for column in manifest['columns']}
+    columns = [c for c in (columns if columns is not None else stored) if c in stored]
+    rows = None
+
+    if years is not None and len(manifest['dates']) > 0:
+        dates = load_column(cache_dir, stored[manifest['dates'][0]])
+        start = np.datetime64(str(years['from']) + '-01-01')
+        end = np.datetime64(str(years['to'] + 1) + '-01-01')
+        rows = np.flatnonzero((dates >= start) & (dates < end))
+
+    data = {}
+
+    for name in columns:
+        values = load_column(cache_dir, stored[name], categories is not None and name in categories)
+        data[name] = values if rows is None else values[rows]
+
+    return pd.DataFrame(data, columns=columns)
+
+
+def read_manifest(cache_dir, filepath):
+    # Returns the manifest if the cache entry exists and was built from the current version of the file
+    try:
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(filepath)
+
+    if manifest['source_mtime'] != stat.st_mtime_ns or manifest['source_size'] != stat.st_size:
+        return None
+
+    return manifest
+
+
+def write_cache(filepath, cache_dir, parse_dates):
+    stat = os.stat(filepath)
+    read = pd.read_excel if filepath.endswith(('.xls', '.xlsx')) else pd.read_csv
+    df = read(filepath, parse_dates=parse_dates)
+    os.makedirs(cache_dir, exist_ok=True)
+    columns = []
+
+    for i, name in enumerate(df.columns):
+        values = df[name]
+        column = {'name': name, 'file': str(i)}
+
+        if pd.api.types.is_datetime64_any_dtype(values):
+            column['kind'] = 'datetime'
+            save_array(cache_dir, column['file'] + '.npy', values.to_numpy().astype('datetime64[ns]'))
+        elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            column['kind'] = 'numeric'
+            save_array(cache_dir, column['file'] + '.npy', values.to_numpy())
+        else:
+            column['kind'] = 'category'
+            codes, categories = pd.factorize(values)
+            save_array(cache_dir, column['file'] + '.npy', codes.astype(np.int32))
+            save_array(cache_dir, column['file'] + '.categories.npy', np.array(categories, dtype=str))
+
+        columns.append(column)
+
+    manifest = {
+        'source_mtime': stat.st_mtime_ns,
+        'source_size': stat.st_size,
+        'rows': len(df),
+        'dates': [c['name'] for c in columns if c['kind'] == 'datetime'],
+        'columns': columns
+    }
+
+    # The manifest is written last so that a partly written cache entry is never used
+    save_file(cache_dir, MANIFEST, lambda f: f.write(json.dumps(manifest).encode()))
+    return manifest
+
+
+def load_column(cache_dir, column, categorical=False):
+    values = np.load(os.path.join(cache_dir, column['file'] + '.npy'), mmap_mode='r')
+
+    if column['kind'] != 'category':
+        return values
+
+    # Strings are decoded back to objects, missing values have code -1 like in a categorical
+    categories = np.load(os.path.join(cache_dir, column['file'] + '.categories.npy')).astype(object)
+
+    if categorical:
+        return pd.Categorical.from_codes(np.asarray(values), categories=categories)
+
+    decoded = np.empty(len(values), dtype=object)
+    decoded[:] = np.nan
+    mask = values >= 0
+    decoded[mask] = categories[values[mask]]
+    return decoded
+
+
+def save_array(cache_dir, filename, array):
+    save_file(cache_dir, filename, lambda f: np.save(f, array, allow_pickle=False))
+
+
+def save_file(cache_dir, filename, write):
+    # Write to a temporary file and rename, so concurrent readers never see half written files
+    path = os.path.join(cache_dir, filename)
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        write(f)
+
+    os.replace(tmp_path, path)
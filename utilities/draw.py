@@ -0,0 +1,135 @@
+# Predictions for a whole tournament draw. The features of all pairs of players are built at once from the feature
+# store, a fitted model scores every pair in a single call and the bracket is simulated many times with array
+# operations, giving the probability of every player to reach each round.
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from utilities import helper as h
+from utilities.ranking_index import RankingIndex
+from utilities.schema import DATA_COLUMNS, COLS_NOT_SCALE, PROCESSED_SCHEMA, apply_schema
+from utilities.tourney_resolver import TourneyResolver
+
+
+def load_draw_state(proc_match_filepath):
+    # Feature store and scaler as left by process_matches, with rankings, tourneys and players for new matches
+    with open(proc_match_filepath + '.state', 'rb') as f:
+        state = pickle.load(f)
+
+    feature_store = state['feature_store']
+    feature_store.ranking_index = RankingIndex(h.load_rankings())
+
+    if feature_store.resolver is None:
+        feature_store.resolver = TourneyResolver()
+
+    feature_store.add_players(h.load_players())
+
+    return feature_store, state['scaler']
+
+
+def get_draw_matches(feature_store, scaler, player_ids, date, tourney_name, surface, tourney_level, t_levels,
+                     surfaces, tourney_id=None):
+    # All ordered pairs of different players as rows like the processed matches (without outcome), scaled with
+    # the scaler of the processed matches. Row i * players + j is player i against player j.
+    features = feature_store.draw_features(player_ids, date, tourney_name, surface, tourney_id)
+    player_ids = np.asarray(player_ids, dtype=np.int64)
+    no_players = len(player_ids)
+    player_1, player_2 = np.divmod(np.arange(no_players * no_players), no_players)
+
+    columns = {column: values.ravel() for column, values in features.items()}
+    columns['tourney_date'] = np.full(len(player_1), pd.Timestamp(date).to_datetime64().astype('datetime64[s]')
+                                      .astype(np.int64))
+    columns['tourney_level'] = np.full(len(player_1), t_levels[tourney_level])
+    columns['player_1'] = player_ids[player_1]
+    columns['player_2'] = player_ids[player_2]
+    columns['surface'] = np.full(len(player_1), surfaces[h.get_surface(surface)])
+
+    data_columns = [column for column in DATA_COLUMNS if column != 'outcome']
+    matches = pd.DataFrame(columns, columns=data_columns).loc[player_1 != player_2]
+
+    matches_not_scale = matches.filter(COLS_NOT_SCALE, axis=1)
+    matches_scale = matches.drop(COLS_NOT_SCALE, axis=1, errors='ignore').astype(np.float64)
+    matches_scale[matches_scale.columns] = scaler.transform(matches_scale)
+    return apply_schema(matches_scale.join(matches_not_scale)[data_columns], PROCESSED_SCHEMA)
+
+
+def score_draw(model, features, matches, no_players):
+    # Probability of player i beating player j for all pairs with a single predict_proba call. Both orders of a
+    # pair are scored and averaged, so that P[i, j] + P[j, i] = 1 like in a real match.
+    proba = model.predict_proba(matches[features])[:, list(model.classes_).index(1)]
+    player_1, player_2 = np.divmod(matches.index.to_numpy(), no_players)
+
+    probabilities = np.full((no_players, no_players), 0.5)
+    probabilities[player_1, player_2] = proba
+    return (probabilities + 1 - probabilities.T) / 2
+
+
+def get_round_names(draw_size):
+    # Names of the rounds reached, e.g. R32, R16, QF, SF, F and W for the winner
+    names = {1: 'W', 2: 'F', 4: 'SF', 8: 'QF'}
+    no_rounds = int(np.log2(draw_size))
+    return [names.get(draw_size >> r, 'R' + str(draw_size >> r)) for r in range(no_rounds + 1)]
+
+
+def simulate_chunk(probabilities, draw, no_simulations, seed):
+    # Counts how often every player reaches each round in no_simulations brackets, played all at once per round
+    rng = np.random.default_rng(seed)
+    no_players = len(probabilities)
+
+    # A bye is an extra player that loses every match
+    p = np.full((no_players + 1, no_players + 1), 0.5)
+    p[:no_players, :no_players] = probabilities
+    p[:no_players, no_players] = 1
+    p[no_players, :no_players] = 0
+
+    alive = np.tile(np.where(draw < 0, no_players, draw), (no_simulations, 1))
+    reached = [np.bincount(alive.ravel(), minlength=no_players + 1)]
+
+    while alive.shape[1] > 1:
+        players_a = alive[:, 0::2]
+        players_b = alive[:, 1::2]
+        a_wins = rng.random(players_a.shape) < p[players_a, players_b]
+        alive = np.where(a_wins, players_a, players_b)
+        reached.append(np.bincount(alive.ravel(), minlength=no_players + 1))
+
+    return np.stack(reached, axis=1)[:no_players]
+
+
+def simulate_bracket(probabilities, draw=None, no_simulations=10000, seed=0, workers=1):
+    # Monte Carlo simulation of a knockout bracket. The draw lists the players (rows of the probabilities) in
+    # bracket order with -1 for a bye, its length must be a power of 2, by default the players in given order.
+    # Returns the probability of every player to reach each round, split over processes in independent streams.
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    draw = np.arange(len(probabilities)) if draw is None else np.asarray(draw, dtype=np.int64)
+
+    if len(draw) < 2 or len(draw) & (len(draw) - 1) != 0:
+        raise ValueError('Draw size must be a power of 2, got ' + str(len(draw)))
+
+    workers = max(1, min(workers, no_simulations))
+    chunks = np.diff(np.linspace(0, no_simulations, workers + 1).astype(np.int64))
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(simulate_chunk, probabilities, draw, chunk, chunk_seed)
+                       for chunk, chunk_seed in zip(chunks, seeds)]
+            reached = sum(future.result() for future in futures)
+    else:
+        reached = simulate_chunk(probabilities, draw, no_simulations, seeds[0])
+
+    return pd.DataFrame(reached / no_simulations, columns=get_round_names(len(draw)))
+
+
+def predict_draw(feature_store, scaler, model, features, player_ids, date, tourney_name, surface, tourney_level,
+                 t_levels, surfaces, draw=None, tourney_id=None, no_simulations=10000, seed=0, workers=1):
+    # Pairwise win probabilities and round probabilities of a draw, the players are given in bracket order
+    # (draw = None) or by the positions of the draw, e.g. a 128 draw of 96 players with byes
+    matches = get_draw_matches(feature_store, scaler, player_ids, date, tourney_name, surface, tourney_level,
+                               t_levels, surfaces, tourney_id)
+    probabilities = score_draw(model, features, matches, len(player_ids))
+    rounds = simulate_bracket(probabilities, draw, no_simulations, seed, workers)
+    rounds.index = pd.Index(player_ids, name='player_id')
+
+    probabilities = pd.DataFrame(probabilities, index=rounds.index, columns=rounds.index)
+    return probabilities, rounds.sort_values(by=list(rounds.columns[::-1]), ascending=False)
@@ -0,0 +1,325 @@
+# In-process feature store, the incremental state behind process_matches that can also score upcoming matches
+import numpy as np
+import pandas as pd
+
+from utilities import helper as h
+from utilities.instrumentation import NO_PROFILER
+from utilities.player_stats import PlayerIndex, HeadToHeadStore, ConditionalStats
+from utilities.ranking_index import RankingIndex
+from utilities.tourney_resolver import TourneyResolver
+from utilities.trackers import RecentFormTracker, TourneyGamesTracker
+
+# Features of a match seen from player 1, in the column order of the processed matches
+FEATURE_COLUMNS = ['rel_total_wins', 'rel_surface_wins', 'mutual_wins', 'mutual_surface_wins', 'mutual_games',
+                   'rank_diff', 'points_grad_diff', 'home_advantage', 'rel_climate_wins', 'rel_recent_wins',
+                   'rel_tourney_games', 'age_diff']
+
+
+class FeatureStore:
+    # Statistics, head-to-head stores and recent form of all players, updated one finished match at a time.
+    # Rankings and player info are only needed for features(), process_matches looks them up in batch.
+
+    def __init__(self, player_index, cond_stats, mutual_matches_clay, mutual_matches_grass, mutual_matches_hard,
+                 mutual_score, t_weights, base_weight, recent_months=3, time_decay=None):
+        self.player_index = player_index
+        self.cond_stats = cond_stats
+        self.mutual_matches_clay = mutual_matches_clay
+        self.mutual_matches_grass = mutual_matches_grass
+        self.mutual_matches_hard = mutual_matches_hard
+        self.mutual_score = mutual_score
+        self.t_weights = t_weights
+        self.base_weight = base_weight
+        self.time_decay = h.load_config()['time_decay'] if time_decay is None else time_decay
+        self.recent_form = RecentFormTracker(recent_months)
+        self.tourney_games = TourneyGamesTracker()
+
+        self.ranking_index = None
+        self.resolver = None
+
+        # Player id to (country, reference date, age at reference date)
+        self.players = {}
+
+    @classmethod
+    def from_stats(cls, stats_filepath, t_weights, base_weight, recent_months=3, time_decay=None):
+        # Loads the generated statistics
+        cond_stats = pd.read_hdf(stats_filepath, key='cs')
+        player_index = PlayerIndex(cond_stats.index)
+        store = cls(player_index, ConditionalStats.from_frame(cond_stats, player_index),
+                    HeadToHeadStore.from_hdf(stats_filepath, 'mm_clay', player_index),
+                    HeadToHeadStore.from_hdf(stats_filepath, 'mm_grass', player_index),
+                    HeadToHeadStore.from_hdf(stats_filepath, 'mm_hard', player_index),
+                    HeadToHeadStore.from_hdf(stats_filepath, 'ms', player_index),
+                    t_weights, base_weight, recent_months, time_decay)
+        print('Generated statistics loaded')
+        return store
+
+    @classmethod
+    def load(cls, stats_filepath, t_weights, base_weight, proc_years, recent_months=3, time_decay=None):
+        # Warms a store for scoring upcoming matches: generated statistics, rankings, player info and all matches
+        # in the pre-processing years, so that the state is the same as after process_matches
+        store = cls.from_stats(stats_filepath, t_weights, base_weight, recent_months, time_decay)
+        store.ranking_index = RankingIndex(h.load_rankings())
+        store.resolver = TourneyResolver()
+        store.add_players(h.load_players())
+
+        matches = h.load_matches(proc_years)
+        matches.sort_values(by=['tourney_date'], inplace=True, ascending=True, kind='mergesort')
+        store.resolver.add_columns(matches)
+        store.add_recent_matches(proc_years['from'] - 1, matches.iloc[0].tourney_date)
+
+        match_weights = list(zip(*h.get_match_weights(matches, t_weights, base_weight, store.time_decay)))
+
+        for i, match in enumerate(matches.itertuples()):
+            store.advance(match.tourney_date, match.match_num)
+            store.update(match, match_weights[i])
+
+        print('Feature store warmed up with', len(matches), 'matches')
+        return store
+
+    def add_recent_matches(self, year, first_date):
+        # Adds the matches of a year that are in the recent window of the first processed match
+        recent_years = {
+            'from': year,
+            'to': year
+        }
+
+        date_limit = first_date - pd.DateOffset(months=self.recent_form.months)
+
+        print('Loading recent matches...')
+        recent_matches = h.load_matches(recent_years)
+        recent_matches = recent_matches.loc[recent_matches.tourney_date >= date_limit]
+
+        for recent_match in recent_matches.itertuples():
+            self.recent_form.add(recent_match.tourney_date, recent_match.tourney_id, recent_match.winner_id,
+                                 recent_match.loser_id)
+
+        self.recent_form.advance(first_date)
+
+    def add_players(self, players):
+        # Country and birth date from the player file, later matches overwrite them
+        players = players.dropna(subset=['birthdate'])
+
+        for player in players.itertuples():
+            self.players[player.player_id] = (player.country, player.birthdate, 0)
+
+    def get_code(self, player_id):
+        # Players not in the statistics get a new code with empty statistics
+        if player_id not in self.player_index:
+            self.player_index.add(player_id)
+            self.cond_stats.resize(len(self.player_index))
+
+        return self.player_index.get_code(player_id)
+
+    def set_player(self, player_id, ioc, date, age):
+        # A missing age keeps the age known from before
+        if pd.isna(age):
+            _, date, age = self.players.get(player_id, (None, None, None))
+
+        self.players[player_id] = (ioc, date, age)
+
+    def get_age(self, player_id, date):
+        _, reference_date, age = self.players.get(player_id, (None, None, None))
+
+        if reference_date is None:
+            return float('nan')
+
+        return age + (date - reference_date).days / 365.25
+
+    def advance(self, date, match_num=None):
+        # Moves the recent form window to date, a match number is only given when replaying historical matches
+        self.recent_form.advance(date)
+        self.tourney_games.advance(date, match_num)
+
+    def get_features(self, player_1_id, player_2_id, tourney_id, surface, climate, rank_diff, points_grad_diff,
+                     home_advantage, age_diff, profiler=NO_PROFILER):
+        # Features of a match between two players, the store has to be advanced to the match date.
+        # The profiler times each feature when the match is sampled.
+        player_1 = self.get_code(player_1_id)
+        player_2 = self.get_code(player_2_id)
+        base_weight = self.base_weight
+        cond_stats = self.cond_stats
+        profiler.lap('player_codes')
+
+        rel_total_wins = round(base_weight * h.get_relative_total_wins(cond_stats, player_1, player_2))
+        profiler.lap('rel_total_wins')
+
+        rel_surface_wins = round(base_weight * h.get_relative_surface_wins(cond_stats, player_1, player_2, surface))
+        profiler.lap('rel_surface_wins')
+
+        mutual_wins = (self.mutual_matches_clay.diff(player_1, player_2) +
+                       self.mutual_matches_grass.diff(player_1, player_2) +
+                       self.mutual_matches_hard.diff(player_1, player_2))
+        profiler.lap('mutual_wins')
+
+        mutual_surface_wins = h.get_mutual_surface_wins(self.mutual_matches_clay, self.mutual_matches_grass,
+                                                        self.mutual_matches_hard, surface, player_1, player_2)
+        profiler.lap('mutual_surface_wins')
+
+        mutual_games = self.mutual_score.diff(player_1, player_2)
+        profiler.lap('mutual_games')
+
+        rel_climate_wins = round(base_weight * h.get_relative_climate_wins(cond_stats, player_1, player_2, climate))
+        profiler.lap('rel_climate_wins')
+
+        rel_recent_wins = round(base_weight * h.get_recent_performance(player_1_id, player_2_id, self.recent_form,
+                                                                       tourney_id))
+        profiler.lap('rel_recent_wins')
+
+        rel_tourney_games = h.get_tourney_games(player_1_id, player_2_id, self.tourney_games, tourney_id)
+        profiler.lap('rel_tourney_games')
+
+        return {
+            'rel_total_wins': rel_total_wins,
+            'rel_surface_wins': rel_surface_wins,
+            'mutual_wins': mutual_wins,
+            'mutual_surface_wins': mutual_surface_wins,
+            'mutual_games': mutual_games,
+            'rank_diff': rank_diff,
+            'points_grad_diff': points_grad_diff,
+            'home_advantage': home_advantage,
+            'rel_climate_wins': rel_climate_wins,
+            'rel_recent_wins': rel_recent_wins,
+            'rel_tourney_games': rel_tourney_games,
+            'age_diff': age_diff
+        }
+
+    def features(self, player_1_id, player_2_id, date, tourney_name, surface, tourney_id=None, match_num=None):
+        # Features of an upcoming match, a dictionary with FEATURE_COLUMNS (not scaled).
+        # The tourney id defaults to the tournament the resolver knows with the same name starting on date, or
+        # else the latest one started at most TOURNEY_DAYS before (a running tournament). A new tournament with
+        # the same name as one of the last two weeks is therefore mistaken for it, pass tourney_id then.
+        # Known differences to the process_matches rows, which use the match entries:
+        # - home_advantage and age_diff use the country and age of the player file or the last match of a player,
+        #   a player without any is not at home and has no age (NaN)
+        # - age_diff extrapolates the rounded age of the last match, it drifts by up to about 0.03 years
+        date = pd.Timestamp(date)
+        _, climate, country_code = self.resolver.resolve(tourney_name)
+
+        if tourney_id is None:
+            tourney_id = self.resolver.get_tourney_id(tourney_name, date)
+
+        self.advance(date, match_num)
+
+        rank_diff, points_grad_diff = h.get_rankings(self.ranking_index, player_1_id, player_2_id, date)
+        player_1_ioc = self.players.get(player_1_id, (None,))[0]
+        player_2_ioc = self.players.get(player_2_id, (None,))[0]
+        home_advantage = h.get_home_advantage(player_1_ioc, player_2_ioc, country_code)
+        age_diff = self.get_age(player_1_id, date) - self.get_age(player_2_id, date)
+
+        return self.get_features(player_1_id, player_2_id, tourney_id, h.get_surface(surface), climate, rank_diff,
+                                 points_grad_diff, home_advantage, age_diff)
+
+    def draw_features(self, player_ids, date, tourney_name, surface, tourney_id=None):
+        # Features of all matches between the players of a draw at once, a dictionary of FEATURE_COLUMNS with
+        # (players x players) arrays where entry [i, j] is the match of player i against player j (not scaled).
+        # Every feature is a difference of per player values or a head-to-head lookup, like in features().
+        date = pd.Timestamp(date)
+        surface = h.get_surface(surface)
+        _, climate, country_code = self.resolver.resolve(tourney_name)
+
+        if tourney_id is None:
+            tourney_id = self.resolver.get_tourney_id(tourney_name, date)
+
+        self.advance(date)
+
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+        codes = np.array([self.get_code(player_id) for player_id in player_ids.tolist()], dtype=np.int64)
+        dates = pd.Series(np.full(len(player_ids), date))
+        ranks, points = self.ranking_index.get_many(player_ids, dates)
+        _, old_points = self.ranking_index.get_many(player_ids, dates - pd.DateOffset(years=1))
+
+        recent_form = np.zeros(len(player_ids))
+        tourney_games = np.zeros(len(player_ids))
+        ages = np.zeros(len(player_ids))
+        home = np.zeros(len(player_ids))
+
+        for i, player_id in enumerate(player_ids.tolist()):
+            recent_wins, recent_played = self.recent_form.get_form(player_id, tourney_id)
+            diff_games, no_matches = self.tourney_games.get_games(player_id, tourney_id)
+            recent_form[i] = recent_wins / recent_played if recent_played > 0 else 0
+            tourney_games[i] = diff_games / no_matches if no_matches > 0 else 0
+            ages[i] = self.get_age(player_id, date)
+            home[i] = not pd.isna(country_code) and self.players.get(player_id, (None,))[0] == country_code
+
+        def diff(values):
+            return values[:, np.newaxis] - values[np.newaxis, :]
+
+        def relative_wins(category):
+            return np.round(self.base_weight * diff(self.cond_stats.get_win_ratios(category, codes))).astype(np.int64)
+
+        mutual_matches = {
+            'clay': self.mutual_matches_clay.get_matrix(codes),
+            'grass': self.mutual_matches_grass.get_matrix(codes),
+            'hard': self.mutual_matches_hard.get_matrix(codes)
+        }
+        mutual_wins = sum(mutual_matches.values())
+        mutual_surface_wins = mutual_matches[surface if surface in mutual_matches else 'hard']
+        mutual_games = self.mutual_score.get_matrix(codes)
+
+        return {
+            'rel_total_wins': relative_wins('total'),
+            'rel_surface_wins': relative_wins('surface_' + surface),
+            'mutual_wins': mutual_wins - mutual_wins.T,
+            'mutual_surface_wins': mutual_surface_wins - mutual_surface_wins.T,
+            'mutual_games': mutual_games - mutual_games.T,
+            'rank_diff': diff(ranks),
+            'points_grad_diff': diff(points - old_points),
+            'home_advantage': diff(home).astype(np.int64),
+            'rel_climate_wins': relative_wins('climate_' + climate),
+            'rel_recent_wins': np.round(self.base_weight * diff(recent_form)).astype(np.int64),
+            'rel_tourney_games': diff(tourney_games),
+            'age_diff': diff(ages)
+        }
+
+    def update(self, result, weights=None):
+        # Ingests a finished match, a row of h.load_matches (e.g. from itertuples()) in date order.
+        # The weights of the match (see h.get_match_weights) are calculated if not given.
+        winner_id = result.winner_id
+        loser_id = result.loser_id
+        winner = self.get_code(winner_id)
+        loser = self.get_code(loser_id)
+        tourney_date = result.tourney_date
+        tourney_id = result.tourney_id
+        surface = h.get_surface(result.surface)
+
+        if self.resolver is None:
+            self.resolver = TourneyResolver()
+
+        climate = result.climate if hasattr(result, 'climate') else self.resolver.resolve(result.tourney_name)[1]
+        self.resolver.add_tourney(result.tourney_name, tourney_date, tourney_id)
+        self.set_player(winner_id, result.winner_ioc, tourney_date, result.winner_age)
+        self.set_player(loser_id, result.loser_ioc, tourney_date, result.loser_age)
+
+        # Add current match to recent matches
+        winner_games = result.winner_games
+        loser_games = result.loser_games
+        self.recent_form.add(tourney_date, tourney_id, winner_id, loser_id)
+        self.tourney_games.add(tourney_date, tourney_id, winner_id, loser_id, winner_games - loser_games)
+
+        # Update stats matrices
+        if weights is None:
+            time_weight = h.get_time_weight(tourney_date, self.time_decay)
+            weights = (round(self.base_weight * time_weight),
+                       round(self.base_weight * time_weight * self.t_weights[result.tourney_level]),
+                       round(self.base_weight * time_weight * winner_games),
+                       round(self.base_weight * time_weight * loser_games))
+
+        match_d_weight, match_dt_weight, winner_games_weight, loser_games_weight = weights
+
+        self.cond_stats.add('total_wins', winner, match_dt_weight)
+        self.cond_stats.add('surface_' + surface + '_wins', winner, match_d_weight)
+        self.cond_stats.add('climate_' + climate + '_wins', winner, match_d_weight)
+        self.cond_stats.add('total_losses', loser, match_dt_weight)
+        self.cond_stats.add('surface_' + surface + '_losses', loser, match_d_weight)
+        self.cond_stats.add('climate_' + climate + '_losses', loser, match_d_weight)
+
+        # Update mutual stats, extract win on surface
+        if surface == 'clay':
+            self.mutual_matches_clay.add(winner, loser, match_d_weight)
+        elif surface == 'grass':
+            self.mutual_matches_grass.add(winner, loser, match_d_weight)
+        else:
+            self.mutual_matches_hard.add(winner, loser, match_d_weight)
+
+        self.mutual_score.add(winner, loser, winner_games_weight)
+        self.mutual_score.add(loser, winner, loser_games_weight)
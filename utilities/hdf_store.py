@@ -0,0 +1,90 @@
+# Compressed HDF5 tables for the generated files. Data columns are indexed by PyTables, so a query by date,
+# player, level or surface only reads the matching rows, and new rows are appended without rewriting the file.
+import numpy as np
+import pandas as pd
+
+from utilities import helper as h
+
+COMPRESSION = {'complib': 'blosc:zstd', 'complevel': 5}
+CHUNK_SIZE = 100000
+
+# Queryable columns of each kind of table
+MATCH_DATA_COLUMNS = ['tourney_date', 'player_1', 'player_2', 'tourney_level', 'surface']
+PAIR_DATA_COLUMNS = ['player', 'opponent']
+ODDS_DATA_COLUMNS = ['tourney_date', 'winner_id', 'loser_id']
+
+
+def write_table(df, filepath, key, data_columns=None, append=False, mode='a'):
+    # Writes or appends a frame as a chunked, compressed table, mode='w' replaces the whole file.
+    # Appended rows must have the same columns as the table.
+    with pd.HDFStore(filepath, mode='a' if append else mode) as store:
+        if not append and key in store:
+            store.remove(key)
+
+        store.append(key, df, format='table', data_columns=data_columns, index=True, chunksize=CHUNK_SIZE,
+                     expectedrows=len(df), **COMPRESSION)
+
+
+def get_unix_time(date):
+    # Processed matches store the date as unix time in seconds
+    return int(pd.Timestamp(date).to_datetime64().astype('datetime64[s]').astype(np.int64))
+
+
+def get_codes(values, codes):
+    # Codes of levels or surfaces given by name (e.g. 'G' or 'clay'), codes are passed through
+    values = values if isinstance(values, (list, tuple, set, np.ndarray, pd.Index)) else [values]
+    return [int(codes.get(value, value)) if isinstance(value, str) else int(value) for value in values]
+
+
+def get_player_condition(players, columns):
+    # Rows where any of the columns is one of the players
+    players = [int(player) for player in np.atleast_1d(players)]
+    return '(' + ' | '.join(column + '=' + str(players) for column in columns) + ')'
+
+
+def query_matches(filepath, date_from=None, date_to=None, player=None, level=None, surface=None, columns=None,
+                  key='matches'):
+    # Processed matches in [date_from, date_to] of one or several players, levels and surfaces, all optional.
+    # Levels and surfaces are given by name or by their code in the file, e.g.
+    # query_matches(path, '2018-01-01', '2018-12-31', player=104925, level=['G', 'M'], surface='clay')
+    config = h.load_config()
+    where = []
+
+    if date_from is not None:
+        where.append('tourney_date >= ' + str(get_unix_time(date_from)))
+
+    if date_to is not None:
+        where.append('tourney_date <= ' + str(get_unix_time(date_to)))
+
+    if player is not None:
+        where.append(get_player_condition(player, ['player_1', 'player_2']))
+
+    if level is not None:
+        where.append('tourney_level=' + str(get_codes(level, config['tourney_levels'])))
+
+    if surface is not None:
+        where.append('surface=' + str(get_codes(surface, config['surfaces'])))
+
+    return pd.read_hdf(filepath, key=key, where=' & '.join(where) if where else None, columns=columns)
+
+
+def query_head_to_head(filepath, key, player):
+    # Head-to-head entries (player, opponent, value) of one or several players from a statistics file,
+    # e.g. query_head_to_head(path, 'mm_clay', 104925)
+    return pd.read_hdf(filepath, key=key, where=get_player_condition(player, PAIR_DATA_COLUMNS))
+
+
+def query_odds(filepath, date_from=None, date_to=None, player=None, key='odds'):
+    # Merged odds in [date_from, date_to] of one or several players
+    where = []
+
+    if date_from is not None:
+        where.append('tourney_date >= ' + repr(str(pd.Timestamp(date_from))))
+
+    if date_to is not None:
+        where.append('tourney_date <= ' + repr(str(pd.Timestamp(date_to))))
+
+    if player is not None:
+        where.append(get_player_condition(player, ['winner_id', 'loser_id']))
+
+    return pd.read_hdf(filepath, key=key, where=' & '.join(where) if where else None)
@@ -1,10 +1,37 @@
 # Helper functions
 import datetime as dt
+import functools
+import json
 import pandas as pd
 import numpy as np
 import os
 import re
-from definitions import RAW_PATH
+from concurrent.futures import ThreadPoolExecutor
+from definitions import RAW_PATH, ROOT_DIR
+from utilities.csv_cache import read_csv_cached
+from utilities.schema import MATCH_SCHEMA, RANKING_SCHEMA, PLAYER_SCHEMA, apply_schema, concat_frames, get_categories
+
+MATCH_COLUMNS = ['tourney_name', 'winner_id', 'winner_ioc', 'loser_id', 'loser_ioc', 'tourney_date', 'tourney_level',
+                 'surface', 'score', 'match_num', 'tourney_id', 'winner_age', 'loser_age']
+
+# Decay kernels of the time weights, functions of the time since the match divided by the configured years
+TIME_KERNELS = {
+    'exponential': lambda t: np.exp(-t),
+    'linear': lambda t: np.maximum(1 - t, 0),
+    'constant': lambda t: np.ones_like(t)
+}
+
+
+# Settings that older config.json files do not have, dicts are completed key by key
+CONFIG_DEFAULTS = {
+    'time_decay': {'reference_date': '2019-01-01', 'years': 5, 'kernel': 'exponential'},
+    'recent_months': 3,
+    'checkpoint_every': 10000,
+    'load_workers': 4,
+    'instrumentation': {'sample_every': 100, 'progress_every': 1000, 'trace_memory': False},
+    'append_training': False,
+    'merge_odds': False
+}
 
 
 # Timing logger for dataframe operations
@@ -28,15 +55,10 @@ def logger(f):
     return wrapper
 
 
-def get_home_advantage(winner_ioc, loser_ioc, tourneys, tourney_name):
-    location = filter_tourney_name(tourney_name)
-    country_code = tourneys.loc[tourneys.location == location, 'country_code']
-
-    if len(country_code) == 0:
+def get_home_advantage(winner_ioc, loser_ioc, country_code):
+    if pd.isna(country_code):
         return 0
     else:
-        country_code = country_code.iloc[0]
-
         if winner_ioc == country_code and loser_ioc == country_code:
             return 0
         elif winner_ioc == country_code:
@@ -100,31 +122,56 @@ def extract_player_ids(years):
     return players
 
 
-def load_matches(years, player_ids=None):
+def load_config():
+    # Read configuration file, missing settings get the defaults of CONFIG_DEFAULTS
+    with open(os.path.join(ROOT_DIR, 'config.json')) as f:
+        config = json.load(f)
+
+    for key, default in CONFIG_DEFAULTS.items():
+        config[key] = {**default, **config.get(key, {})} if isinstance(default, dict) else config.get(key, default)
+
+    return config
+
+
+def load_files(read_file, filepaths, workers=None):
+    # Reads files concurrently and returns the frames in the order of filepaths
+    if workers is None:
+        workers = load_config()['load_workers']
+
+    if workers <= 1:
+        return [read_file(filepath) for filepath in filepaths]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(read_file, filepaths))
+
+
+def load_matches(years, player_ids=None, workers=None):
     # Load matches in a specific year range
     # If specified, sorts out matches where no players are in player_ids
-    matches = []
+    filepaths = []
 
     for year in range(years['from'], years['to'] + 1):
-        matches.append(
-            pd.read_csv(os.path.join(RAW_PATH, 'atp_matches_futures_' + str(year) + '.csv'),
-                        parse_dates=['tourney_date']))
-        matches.append(
-            pd.read_csv(os.path.join(RAW_PATH, 'atp_matches_qual_chall_' + str(year) + '.csv'),
-                        parse_dates=['tourney_date']))
-        matches.append(
-            pd.read_csv(os.path.join(RAW_PATH, 'atp_matches_' + str(year) + '.csv'), parse_dates=['tourney_date']))
-
-    matches = pd.concat(matches, sort=False)
-
-    if player_ids is not None:
-        # Remove not wanted matches
-        matches = matches[matches['winner_id'].isin(player_ids) | matches['loser_id'].isin(player_ids)]
-
-    # Drop not relevant columns
-    matches = matches.filter(
-        ['tourney_name', 'winner_id', 'winner_ioc', 'loser_id', 'loser_ioc', 'tourney_date', 'tourney_level',
-         'surface', 'score', 'match_num', 'tourney_id', 'winner_age', 'loser_age'])
+        for prefix in ['atp_matches_futures_', 'atp_matches_qual_chall_', 'atp_matches_']:
+            filepaths.append(os.path.join(RAW_PATH, prefix + str(year) + '.csv'))
+
+    def read_file(filepath):
+        # Drop not relevant columns while reading, strings are read as categoricals
+        matches_file = read_csv_cached(filepath, parse_dates=['tourney_date'], columns=MATCH_COLUMNS,
+                                       categories=get_categories(MATCH_SCHEMA))
+        matches_file = apply_schema(matches_file, MATCH_SCHEMA)
+
+        if player_ids is not None:
+            # Remove not wanted matches
+            matches_file = matches_file[matches_file['winner_id'].isin(player_ids) |
+                                        matches_file['loser_id'].isin(player_ids)]
+
+        return matches_file
+
+    matches = concat_frames(load_files(read_file, filepaths, workers))
+
+    # Parse all scores once
+    matches['winner_games'], matches['loser_games'], matches['completed'] = parse_scores(matches['score'])
+    matches = apply_schema(matches, MATCH_SCHEMA)
 
     # Sort by date (oldest ranking first)
     matches.sort_values(by=['tourney_date', 'match_num'], inplace=True, ascending=True)
@@ -133,10 +180,57 @@ def load_matches(years, player_ids=None):
     return matches
 
 
-def get_time_weight(current_date):
-    # Return an exponential weighted time decay, base year is 2019
-    time_delta = (dt.date(2019, 1, 1) - current_date.date()).days
-    return np.exp(-time_delta / (365 * 5))
+def get_time_weight(current_date, time_decay=None):
+    # Time decay weight of a single date with plain date arithmetic, FeatureStore.update calls it for every result.
+    # Gives the same weight as get_time_weights.
+    if time_decay is None:
+        time_decay = get_default_time_decay()
+
+    if isinstance(current_date, dt.datetime):
+        current_date = current_date.date()
+    elif not isinstance(current_date, dt.date):
+        current_date = pd.Timestamp(current_date).date()
+
+    time_delta = (dt.date.fromisoformat(time_decay['reference_date']) - current_date).days
+    return float(TIME_KERNELS[time_decay['kernel']](time_delta / (365 * time_decay['years'])))
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_time_decay():
+    # The time decay of config.json, read once
+    return load_config()['time_decay']
+
+
+def get_time_weights(dates, time_decay=None):
+    # Time decay weights for a whole column of dates, the reference date, years and kernel are set in config.json.
+    # The default is an exponential decay with a scale of 5 years from 2019.
+    if time_decay is None:
+        time_decay = get_default_time_decay()
+
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]')
+    time_deltas = (np.datetime64(time_decay['reference_date'], 'D') - dates).astype(np.int64)
+    return TIME_KERNELS[time_decay['kernel']](time_deltas / (365 * time_decay['years']))
+
+
+def get_match_weights(matches, t_weights, base_weight, time_decay=None):
+    # Rounded weights of all matches used to update the statistics: time decayed (d), time decayed and tournament
+    # level weighted (dt) and the time decayed games of the winner and the loser. Every tourney level needs a weight.
+    levels = matches['tourney_level']
+    unknown = ~levels.isin(list(t_weights))
+
+    if unknown.any():
+        raise KeyError('No tourney weight for levels: ' + ', '.join(sorted(str(level) for level in
+                                                                           levels[unknown].unique())))
+
+    time_weights = get_time_weights(matches['tourney_date'], time_decay)
+    tourney_weights = levels.map(t_weights).to_numpy(dtype=np.float64)
+
+    match_d_weights = np.round(base_weight * time_weights).astype(np.int64)
+    match_dt_weights = np.round(base_weight * time_weights * tourney_weights).astype(np.int64)
+    winner_games_weights = np.round(base_weight * time_weights * matches['winner_games'].to_numpy()).astype(np.int64)
+    loser_games_weights = np.round(base_weight * time_weights * matches['loser_games'].to_numpy()).astype(np.int64)
+
+    return match_d_weights, match_dt_weights, winner_games_weights, loser_games_weights
 
 
 def get_surface(surface):
@@ -145,32 +239,41 @@ def get_surface(surface):
     return 'hard' if surface == 'nan' or surface == 'none' or surface == 'carpet' else surface
 
 
-def get_score(score):
-    games_w = 0
-    games_l = 0
+def parse_scores(scores):
+    # Parses a whole score column at once into the games won by the winner and the loser. Tiebreak points like
+    # the (10) in 7-6(10) are not games, a match tiebreak like [10-8] counts as a single game.
+    # Most scores repeat, so only the distinct ones are parsed.
+    codes, scores = pd.factorize(scores, use_na_sentinel=False)
+    scores = pd.Series(scores, dtype=object).fillna('').astype(str)
+    sets = scores.str.extractall(r'(?P<tiebreak>\[)?(?P<winner>\d+)-(?P<loser>\d+)')
+    winner_games = sets['winner'].astype(np.int64)
+    loser_games = sets['loser'].astype(np.int64)
+
+    match_tiebreak = sets['tiebreak'].notna()
+    winner_games, loser_games = (winner_games.where(~match_tiebreak, (winner_games > loser_games).astype(np.int64)),
+                                 loser_games.where(~match_tiebreak, (loser_games > winner_games).astype(np.int64)))
+
+    match_level = sets.index.get_level_values(0)
+    winner_games = winner_games.groupby(match_level).sum().reindex(scores.index, fill_value=0)
+    loser_games = loser_games.groupby(match_level).sum().reindex(scores.index, fill_value=0)
+    no_sets = sets['winner'].groupby(match_level).size().reindex(scores.index, fill_value=0)
 
-    try:
-        for m in re.finditer('-', score):
-            i = m.start()
-            games_w += int(score[i - 1])
-            games_l += int(score[i + 1])
-    except ValueError:
-        print(score)
+    # Retirements, walkovers, defaults and abandoned matches are not completed
+    not_completed = scores.str.contains(r'RET|W/O|DEF|Walkover|abandoned|Unfinished|In Progress', case=False)
+    completed = ~not_completed & (no_sets > 0)
 
-    return games_w, games_l
+    return winner_games.to_numpy()[codes], loser_games.to_numpy()[codes], completed.to_numpy()[codes]
 
 
-def print_progress(i, no_matches):
-    # Prints the process
-    if i % 1000 == 0:
-        print(i, 'matches (' + str(round(i / no_matches * 100, 2)) + '%) processed')
+def load_rankings(years=None, workers=None):
+    # Loads player rankings and sorts them in ascending order, if specified only for a year range
+    filepaths = [os.path.join(RAW_PATH, 'atp_rankings_10s.csv'), os.path.join(RAW_PATH, 'atp_rankings_current.csv')]
 
+    def read_file(filepath):
+        rankings_file = read_csv_cached(filepath, parse_dates=['ranking_date'], years=years)
+        return apply_schema(rankings_file, RANKING_SCHEMA)
 
-def load_rankings():
-    # Loads player rankings and sorts them in ascending order
-    rankings_10s = pd.read_csv(os.path.join(RAW_PATH, 'atp_rankings_10s.csv'), parse_dates=['ranking_date'])
-    rankings_current = pd.read_csv(os.path.join(RAW_PATH, 'atp_rankings_current.csv'), parse_dates=['ranking_date'])
-    rankings = pd.concat([rankings_10s, rankings_current], sort=False)
+    rankings = pd.concat(load_files(read_file, filepaths, workers), sort=False)
 
     # Sort by date (oldest ranking first)
     rankings.sort_values(by=['ranking_date'], inplace=True, ascending=True)
@@ -179,37 +282,25 @@ def load_rankings():
     return rankings
 
 
-def get_tourney_games(winner_id, loser_id, recent_matches, tourney_id, match_num):
+def load_players():
+    # Loads player ids with country and birth date, birth dates are stored as yyyymmdd numbers
+    players = read_csv_cached(os.path.join(RAW_PATH, 'atp_players.csv'), columns=['player_id', 'country', 'birthdate'],
+                              categories=get_categories(PLAYER_SCHEMA))
+    birthdates = players['birthdate'].astype('Int64').astype(str)
+    players['birthdate'] = pd.to_datetime(birthdates, format='%Y%m%d', errors='coerce')
+    return apply_schema(players, PLAYER_SCHEMA)
+
+
+def load_player_names():
+    # Loads player ids with first and last names
+    players = read_csv_cached(os.path.join(RAW_PATH, 'atp_players.csv'), columns=['player_id', 'firstname', 'lastname'])
+    return apply_schema(players, PLAYER_SCHEMA)
+
+
+def get_tourney_games(winner_id, loser_id, tourney_games, tourney_id):
     # Get recent performance in relative number of games diff IN CURRENT tournament
-    diff_games_winner = 0
-    no_matches_winner = 0
-    diff_games_loser = 0
-    no_matches_loser = 0
-
-    for match in recent_matches.itertuples():
-        if match.tourney_id == tourney_id and match.match_num < match_num:
-            try:
-                winner_games, loser_games = get_score(match.score)
-            except ValueError:
-                winner_games = 0
-                loser_games = 0
-
-            diff_score = winner_games - loser_games
-
-            # Note that I am accounting for round robin match types here, e.g. ATP finals
-            if match.winner_id == winner_id:
-                diff_games_winner += diff_score
-                no_matches_winner += 1
-            elif match.loser_id == winner_id:
-                diff_games_winner -= diff_score
-                no_matches_winner += 1
-
-            if match.winner_id == loser_id:
-                diff_games_loser += diff_score
-                no_matches_loser += 1
-            elif match.loser_id == loser_id:
-                diff_games_loser -= diff_score
-                no_matches_loser += 1
+    diff_games_winner, no_matches_winner = tourney_games.get_games(winner_id, tourney_id)
+    diff_games_loser, no_matches_loser = tourney_games.get_games(loser_id, tourney_id)
 
     avg_diff_winner = 0
     avg_diff_loser = 0
@@ -223,26 +314,10 @@ def get_tourney_games(winner_id, loser_id, recent_matches, tourney_id, match_num
     return avg_diff_winner - avg_diff_loser
 
 
-def get_recent_performance(winner_id, loser_id, recent_matches, tourney_id):
+def get_recent_performance(winner_id, loser_id, recent_form, tourney_id):
     # Extract recent perfomance in terms of relative win from recent matches BEFORE tournament
-    recent_wins_winner = 0
-    recent_played_winner = 0
-    recent_wins_loser = 0
-    recent_played_loser = 0
-
-    for match in recent_matches.itertuples():
-        if match.tourney_id != tourney_id:
-            if match.winner_id == winner_id:
-                recent_wins_winner += 1
-                recent_played_winner += 1
-            elif match.winner_id == loser_id:
-                recent_wins_loser += 1
-                recent_played_loser += 1
-
-            if match.loser_id == winner_id:
-                recent_played_winner += 1
-            elif match.loser_id == loser_id:
-                recent_played_loser += 1
+    recent_wins_winner, recent_played_winner = recent_form.get_form(winner_id, tourney_id)
+    recent_wins_loser, recent_played_loser = recent_form.get_form(loser_id, tourney_id)
 
     if recent_played_winner == 0:
         rel_wins_winner = 0
@@ -257,14 +332,14 @@ def get_recent_performance(winner_id, loser_id, recent_matches, tourney_id):
     return rel_wins_winner - rel_wins_loser
 
 
-def get_relative_climate_wins(cond_stats, winner_id, loser_id, climate):
+def get_relative_climate_wins(cond_stats, winner, loser, climate):
     # For each player, calculates the ratio won matches in the current climate and
     # then takes the difference between them
-    climate_wins_winner = cond_stats['climate_' + climate + '_wins'][winner_id]
-    climate_losses_winner = cond_stats['climate_' + climate + '_losses'][winner_id]
+    climate_wins_winner = cond_stats.get('climate_' + climate + '_wins', winner)
+    climate_losses_winner = cond_stats.get('climate_' + climate + '_losses', winner)
     climate_played_winner = climate_wins_winner + climate_losses_winner
-    climate_wins_loser = cond_stats['climate_' + climate + '_wins'][loser_id]
-    climate_losses_loser = cond_stats['climate_' + climate + '_losses'][loser_id]
+    climate_wins_loser = cond_stats.get('climate_' + climate + '_wins', loser)
+    climate_losses_loser = cond_stats.get('climate_' + climate + '_losses', loser)
     climate_played_loser = climate_wins_loser + climate_losses_loser
 
     if climate_played_winner == 0:
@@ -280,14 +355,14 @@ def get_relative_climate_wins(cond_stats, winner_id, loser_id, climate):
     return rel_climate_wins_winner - rel_climate_wins_loser
 
 
-def get_relative_surface_wins(cond_stats, winner_id, loser_id, surface):
+def get_relative_surface_wins(cond_stats, winner, loser, surface):
     # For each player, calculates the ratio won matches on the surface and
     # then takes the difference between them
-    surface_wins_winner = cond_stats['surface_' + surface + '_wins'][winner_id]
-    surface_losses_winner = cond_stats['surface_' + surface + '_losses'][winner_id]
+    surface_wins_winner = cond_stats.get('surface_' + surface + '_wins', winner)
+    surface_losses_winner = cond_stats.get('surface_' + surface + '_losses', winner)
     surface_played_winner = surface_wins_winner + surface_losses_winner
-    surface_wins_loser = cond_stats['surface_' + surface + '_wins'][loser_id]
-    surface_losses_loser = cond_stats['surface_' + surface + '_losses'][loser_id]
+    surface_wins_loser = cond_stats.get('surface_' + surface + '_wins', loser)
+    surface_losses_loser = cond_stats.get('surface_' + surface + '_losses', loser)
     surface_played_loser = surface_wins_loser + surface_losses_loser
 
     if surface_played_winner == 0:
@@ -303,14 +378,14 @@ def get_relative_surface_wins(cond_stats, winner_id, loser_id, surface):
     return rel_surface_wins_winner - rel_surface_wins_loser
 
 
-def get_relative_total_wins(cond_stats, winner_id, loser_id):
+def get_relative_total_wins(cond_stats, winner, loser):
     # For each player, calculates the ratio won matches in total and
     # then takes the difference between them
-    total_wins_winner = cond_stats['total_wins'][winner_id]
-    total_losses_winner = cond_stats['total_losses'][winner_id]
+    total_wins_winner = cond_stats.get('total_wins', winner)
+    total_losses_winner = cond_stats.get('total_losses', winner)
     total_played_winner = total_wins_winner + total_losses_winner
-    total_wins_loser = cond_stats['total_wins'][loser_id]
-    total_losses_loser = cond_stats['total_losses'][loser_id]
+    total_wins_loser = cond_stats.get('total_wins', loser)
+    total_losses_loser = cond_stats.get('total_losses', loser)
     total_played_loser = total_wins_loser + total_losses_loser
 
     if total_played_winner == 0:
@@ -326,61 +401,25 @@ def get_relative_total_wins(cond_stats, winner_id, loser_id):
     return rel_total_wins_winner - rel_total_wins_loser
 
 
-def get_mutual_surface_wins(mm_clay, mm_grass, mm_hard, surface, winner_id, loser_id):
+def get_mutual_surface_wins(mm_clay, mm_grass, mm_hard, surface, winner, loser):
     # Calculates the difference in wins between opponents on specified surface
     if surface == 'clay':
-        return mm_clay[winner_id][loser_id] - mm_clay[loser_id][winner_id]
+        return mm_clay.diff(winner, loser)
     elif surface == 'grass':
-        return mm_grass[winner_id][loser_id] - mm_grass[loser_id][winner_id]
+        return mm_grass.diff(winner, loser)
     else:
-        return mm_hard[winner_id][loser_id] - mm_hard[loser_id][winner_id]
+        return mm_hard.diff(winner, loser)
 
 
-def get_rankings(rankings, winner_id, loser_id, tourney_date):
+def get_rankings(ranking_index, winner_id, loser_id, tourney_date):
     # Get the current ranking differents and the one year ranking gradient in points
-    winner_rankings = rankings.loc[rankings['player'] == winner_id]
-    loser_rankings = rankings.loc[rankings['player'] == loser_id]
-    highest_numbered_ranking = np.max(rankings['rank'])
-
-    # Set date as ranking index, delete possible duplicates due to overlapping lists
-    winner_rankings.set_index('ranking_date', inplace=True)
-    winner_rankings = winner_rankings.loc[~winner_rankings.index.duplicated(keep='first')]
-    loser_rankings.set_index('ranking_date', inplace=True)
-    loser_rankings = loser_rankings.loc[~loser_rankings.index.duplicated(keep='first')]
-
-    # It is not certain that all players have a ranking right now
-    try:
-        winner_current_rank = winner_rankings.iloc[winner_rankings.index.get_loc(tourney_date, method='pad')]
-        winner_current_points = winner_current_rank['points']
-        winner_current_rank = winner_current_rank['rank']
-    except KeyError:
-        winner_current_rank = highest_numbered_ranking + 1
-        winner_current_points = 0
-
-    try:
-        loser_current_rank = loser_rankings.iloc[loser_rankings.index.get_loc(tourney_date, method='pad')]
-        loser_current_points = loser_current_rank['points']
-        loser_current_rank = loser_current_rank['rank']
-    except KeyError:
-        loser_current_rank = highest_numbered_ranking + 1
-        loser_current_points = 0
-
+    winner_current_rank, winner_current_points = ranking_index.get(winner_id, tourney_date)
+    loser_current_rank, loser_current_points = ranking_index.get(loser_id, tourney_date)
     rank_diff = winner_current_rank - loser_current_rank
 
     last_year_date = tourney_date - pd.DateOffset(years=1)
-
-    # It is not certain that all players had a ranking one year ago
-    try:
-        winner_old_rank = winner_rankings.iloc[winner_rankings.index.get_loc(last_year_date, method='pad')]
-        winner_old_points = winner_old_rank['points']
-    except KeyError:
-        winner_old_points = 0
-
-    try:
-        loser_old_rank = winner_rankings.iloc[winner_rankings.index.get_loc(last_year_date, method='pad')]
-        loser_old_points = loser_old_rank['points']
-    except KeyError:
-        loser_old_points = 0
+    _, winner_old_points = ranking_index.get(winner_id, last_year_date)
+    _, loser_old_points = ranking_index.get(loser_id, last_year_date)
 
     winner_points_grad = winner_current_points - winner_old_points
     loser_points_grad = loser_current_points - loser_old_points
@@ -0,0 +1,175 @@
+# Stage timing, sampled per feature timing, memory use and progress with ETA for stats.py and pre_processing.py.
+# The results are collected in a report that is saved as JSON next to the generated file.
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak RSS is then not reported
+    resource = None
+
+
+class Profiler:
+    # Stages are timed on every call. Features inside the match loop are only timed for every sample_every-th
+    # match, between two laps, so that the overhead of the other matches is a single flag check per lap.
+
+    def __init__(self, name, sample_every=100, progress_every=1000, trace_memory=False):
+        self.name = name
+        self.sample_every = sample_every
+        self.progress_every = progress_every
+        self.trace_memory = trace_memory
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.features = {}
+
+        # Sampling state of the match loop
+        self.active = False
+        self.last_lap = None
+        self.no_sampled = 0
+
+        # Progress of the match loop
+        self.loop_start = None
+        self.loop_first = 0
+        self.loop_total = 0
+        self.loop_done = 0
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        # Times a block of code and records the memory peak at its end
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += time.perf_counter() - start
+            stage['peak_rss_mb'] = get_peak_rss_mb()
+
+            if self.trace_memory:
+                traced_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                stage['traced_peak_mb'] = max(stage.get('traced_peak_mb', 0), traced_peak)
+
+    def sample(self, i):
+        # Turns the feature timing on for every sample_every-th match and starts the first lap
+        self.active = self.sample_every > 0 and i % self.sample_every == 0
+
+        if self.active:
+            self.no_sampled += 1
+            self.last_lap = time.perf_counter()
+
+        return self.active
+
+    def lap(self, name):
+        # Adds the time since the last lap to a feature, does nothing if the match is not sampled
+        if not self.active:
+            return
+
+        now = time.perf_counter()
+        feature = self.features.setdefault(name, [0, 0.0])
+        feature[0] += 1
+        feature[1] += now - self.last_lap
+        self.last_lap = now
+
+    def start_loop(self, total, done=0):
+        # Starts the progress of a loop over total items, of which done were processed before (e.g. resumed)
+        self.loop_start = time.perf_counter()
+        self.loop_first = done
+        self.loop_total = total
+        self.loop_done = done
+
+    def progress(self, i):
+        # Prints the progress with the processing rate and the estimated time left
+        self.loop_done = i
+
+        if i % self.progress_every != 0 and i != self.loop_total:
+            return
+
+        seconds = time.perf_counter() - self.loop_start
+        rate = (i - self.loop_first) / seconds if seconds > 0 else 0
+        eta = (self.loop_total - i) / rate if rate > 0 else 0
+        print(i, 'matches (' + str(round(i / self.loop_total * 100, 2)) + '%) processed,', round(rate),
+              'matches/s, ETA', format_seconds(eta))
+
+    def set_processed(self, no_matches):
+        # Number of processed matches for runs without a match loop
+        self.loop_first = 0
+        self.loop_done = no_matches
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def report(self):
+        # Feature times are scaled up from the sampled matches to all matches of the loop
+        no_items = self.loop_done - self.loop_first
+        sampled_seconds = sum(seconds for _, seconds in self.features.values())
+        features = {}
+
+        for name, (calls, seconds) in sorted(self.features.items(), key=lambda item: -item[1][1]):
+            features[name] = {
+                'sampled_calls': calls,
+                'sampled_seconds': seconds,
+                'mean_us': seconds / calls * 1e6,
+                'estimated_seconds': seconds / self.no_sampled * no_items if self.no_sampled > 0 else 0,
+                'share': seconds / sampled_seconds if sampled_seconds > 0 else 0
+            }
+
+        total_seconds = self.elapsed()
+
+        return {
+            'name': self.name,
+            'total_seconds': total_seconds,
+            'peak_rss_mb': get_peak_rss_mb(),
+            'matches': no_items,
+            'matches_per_second': no_items / total_seconds if total_seconds > 0 else 0,
+            'sample_every': self.sample_every,
+            'sampled_matches': self.no_sampled,
+            'stages': self.stages,
+            'features': features
+        }
+
+    def save(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+        print('Report saved to', filepath)
+
+    def print_summary(self):
+        # Slowest stages and features first
+        report = self.report()
+
+        for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+            print('{:<28} {:>9.2f}s'.format(name, stage['seconds']))
+
+        for name, feature in report['features'].items():
+            print('{:<28} {:>9.2f}us {:>6.1f}%'.format(name, feature['mean_us'], feature['share'] * 100))
+
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, kilobytes on Linux
+    return peak_rss / 2 ** 20 if sys.platform == 'darwin' else peak_rss / 2 ** 10
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{:d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+# Used when no profiler is given, never samples
+NO_PROFILER = Profiler('none', sample_every=0)
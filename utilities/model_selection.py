@@ -0,0 +1,190 @@
+# Cross validates a grid of models and feature subsets on all cores. Every fold result is cached on disk, keyed by
+# a hash of the data, the features, the model and its parameters, so a rerun only fits what changed.
+import hashlib
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import AdaBoostClassifier, RandomForestClassifier
+from sklearn.feature_selection import RFE
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, log_loss
+from sklearn.model_selection import StratifiedKFold
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.neural_network import MLPClassifier
+from sklearn.svm import SVC
+
+from definitions import CACHE_PATH
+
+MODELS = {
+    'random_forest': RandomForestClassifier,
+    'logistic_regression': LogisticRegression,
+    'knn': KNeighborsClassifier,
+    'mlp': MLPClassifier,
+    'svc': SVC,
+    'ada_boost': AdaBoostClassifier
+}
+CACHE_DIR = os.path.join(CACHE_PATH, 'model_selection')
+
+# Data of the worker processes, set once per process instead of sent with every fold
+worker_data = {}
+
+
+def make_model(model, params):
+    # Creates an estimator of the MODELS, 'rfe' wraps one of them in a recursive feature elimination,
+    # e.g. params = {'estimator': 'random_forest', 'estimator_params': {'max_depth': 10}, 'n_features_to_select': 3}
+    if model == 'rfe':
+        params = dict(params)
+        estimator = make_model(params.pop('estimator'), params.pop('estimator_params', {}))
+        return RFE(estimator, **params)
+
+    return MODELS[model](**params)
+
+
+def get_data_hash(X, y):
+    # Hash of the values, the index and the columns, so any change of the data gives a new key
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(X, index=True).to_numpy().tobytes())
+    h.update(pd.util.hash_pandas_object(y, index=True).to_numpy().tobytes())
+    h.update(json.dumps(list(map(str, X.columns))).encode())
+    return h.hexdigest()
+
+
+def get_fold_key(data_hash, entry, fold, no_folds, seed):
+    key = {
+        'data': data_hash,
+        'model': entry['model'],
+        'params': entry.get('params', {}),
+        'features': entry.get('features'),
+        'fold': fold,
+        'no_folds': no_folds,
+        'seed': seed
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_folds(y, no_folds, seed):
+    # Stratified folds like cross_val_score, shuffled only if a seed is given
+    if seed is None:
+        folds = StratifiedKFold(n_splits=no_folds)
+    else:
+        folds = StratifiedKFold(n_splits=no_folds, shuffle=True, random_state=seed)
+
+    return list(folds.split(np.zeros(len(y)), y))
+
+
+def set_worker_data(X, y, no_folds, seed):
+    worker_data['X'] = X
+    worker_data['y'] = y
+    worker_data['folds'] = get_folds(y, no_folds, seed)
+
+
+def fit_fold(entry, fold):
+    # Fits one model on the training part of a fold and scores it on the rest
+    X = worker_data['X']
+    y = worker_data['y']
+    train, test = worker_data['folds'][fold]
+
+    if entry.get('features') is not None:
+        X = X[entry['features']]
+
+    model = make_model(entry['model'], entry.get('params', {}))
+
+    start = time.perf_counter()
+    model.fit(X.iloc[train], y.iloc[train])
+    fit_time = time.perf_counter() - start
+
+    result = {
+        'accuracy': accuracy_score(y.iloc[test], model.predict(X.iloc[test])),
+        'log_loss': np.nan,
+        'fit_time': fit_time
+    }
+
+    # Not all models give probabilities, e.g. SVC without probability=True
+    if hasattr(model, 'predict_proba'):
+        result['log_loss'] = log_loss(y.iloc[test], model.predict_proba(X.iloc[test]), labels=model.classes_)
+
+    return result
+
+
+def load_result(cache_dir, key):
+    try:
+        with open(os.path.join(cache_dir, key + '.pkl'), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def save_result(cache_dir, key, result):
+    # Write to a temporary file and rename, so that an interrupted run never leaves a broken entry
+    path = os.path.join(cache_dir, key + '.pkl')
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(tmp_path, path)
+
+
+def run_model_selection(X, y, grid, no_folds=10, workers=None, seed=None, cache_dir=CACHE_DIR):
+    # Cross validates every entry of the grid, e.g.
+    # {'name': 'lr_reduced', 'model': 'logistic_regression', 'params': {'C': 1}, 'features': ['rank_diff']}
+    # Returns one row per entry with the mean and spread of the fold accuracies, the mean log-loss and fit time
+    if workers is None:
+        workers = os.cpu_count()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    data_hash = get_data_hash(X, y)
+    results = {}
+    tasks = []
+
+    for i, entry in enumerate(grid):
+        for fold in range(no_folds):
+            key = get_fold_key(data_hash, entry, fold, no_folds, seed)
+            result = load_result(cache_dir, key)
+
+            if result is None:
+                tasks.append((i, fold, key))
+            else:
+                results[(i, fold)] = dict(result, cached=True)
+
+    print('Model selection:', len(grid) * no_folds, 'folds,', len(tasks), 'to fit,',
+          len(grid) * no_folds - len(tasks), 'cached')
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_worker_data,
+                                 initargs=(X, y, no_folds, seed)) as executor:
+            futures = [(i, fold, key, executor.submit(fit_fold, grid[i], fold)) for i, fold, key in tasks]
+
+            for i, fold, key, future in futures:
+                results[(i, fold)] = future.result()
+                save_result(cache_dir, key, results[(i, fold)])
+    elif len(tasks) > 0:
+        set_worker_data(X, y, no_folds, seed)
+
+        for i, fold, key in tasks:
+            results[(i, fold)] = fit_fold(grid[i], fold)
+            save_result(cache_dir, key, results[(i, fold)])
+
+    rows = []
+
+    for i, entry in enumerate(grid):
+        folds = [results[(i, fold)] for fold in range(no_folds)]
+        accuracies = np.array([f['accuracy'] for f in folds])
+
+        rows.append({
+            'name': entry.get('name', entry['model']),
+            'model': entry['model'],
+            'params': json.dumps(entry.get('params', {}), sort_keys=True, default=str),
+            'features': ', '.join(entry['features']) if entry.get('features') is not None else 'all',
+            'accuracy': accuracies.mean(),
+            'accuracy_std': accuracies.std(),
+            'log_loss': np.mean([f['log_loss'] for f in folds]),
+            'fit_time': np.mean([f['fit_time'] for f in folds]),
+            'cached_folds': sum(f.get('cached', False) for f in folds)
+        })
+
+    return pd.DataFrame(rows).set_index('name')
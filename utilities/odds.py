@@ -0,0 +1,163 @@
+# Computes the bookmaker odds of odds_matches.h5 and attaches them to the processed matches
+import os
+import numpy as np
+import pandas as pd
+
+from definitions import ODDS_PATH
+from utilities import helper as h
+from utilities.csv_cache import read_csv_cached
+
+ODDS_FILE_COLUMNS = ['ATP', 'Date', 'Winner', 'Loser', 'B365W', 'B365L', 'EXW', 'EXL', 'PSW', 'PSL']
+BROKERS = ['b365', 'ex', 'ps']
+ODDS_KEYS = ['tourney_date', 'player_1', 'player_2']
+MATCH_KEYS = ['tourney_date', 'winner_id', 'loser_id']
+
+
+def attach_odds(matches, odds, how='left'):
+    # Adds the best odds of both players to the processed matches with a single keyed merge on date and players
+    # max_player_1 and max_player_2 are the odds of player_1 and player_2, max_winner and max_loser of the winner
+    # and the loser. process_matches always stores the winner as player_1 (only the features and outcome of the
+    # balanced rows are negated), so the odds are only looked up with the odds winner as player_1. Matches where
+    # the odds file and ATP disagree on the winner get no odds.
+    # Matches with more than one odds row for the same date and players are ambiguous and get no odds
+    odds = odds.loc[:, ['tourney_date', 'winner_id', 'loser_id', 'max_w', 'max_l']].dropna()
+
+    keyed_odds = pd.DataFrame({
+        'tourney_date': odds['tourney_date'].to_numpy().astype('datetime64[s]').astype(np.int64),
+        'player_1': odds['winner_id'].to_numpy(dtype=np.int64),
+        'player_2': odds['loser_id'].to_numpy(dtype=np.int64),
+        'max_player_1': odds['max_w'].to_numpy(),
+        'max_player_2': odds['max_l'].to_numpy()
+    })
+    keyed_odds = keyed_odds.loc[~keyed_odds.duplicated(ODDS_KEYS, keep=False)]
+
+    # The processed tourney date is unix time in seconds, the keys are compared as integers
+    keys = pd.DataFrame({key: matches[key].to_numpy(dtype=np.int64) for key in ODDS_KEYS}, index=matches.index)
+    keys = keys.merge(keyed_odds, on=ODDS_KEYS, how='left', validate='many_to_one')
+    keys.index = matches.index
+
+    matches = matches.assign(max_player_1=keys['max_player_1'], max_player_2=keys['max_player_2'])
+    matches['max_winner'] = matches['max_player_1']
+    matches['max_loser'] = matches['max_player_2']
+
+    if how == 'inner':
+        matches = matches.loc[keys['max_player_1'].notna()]
+
+    return matches
+
+
+def load_odds(years, workers=None):
+    # Loads the bookmaker odds of a year range, one Excel file per year. The files go through the same cache as
+    # the CSV files, so only the first load of a file parses the Excel sheet.
+    filepaths = [os.path.join(ODDS_PATH, str(year) + ('.xls' if year < 2013 else '.xlsx'))
+                 for year in range(years['from'], years['to'] + 1)]
+
+    def read_file(filepath):
+        return read_csv_cached(filepath, parse_dates=['Date'], columns=ODDS_FILE_COLUMNS)
+
+    return pd.concat(h.load_files(read_file, filepaths, workers), sort=False)
+
+
+def clean_odds(df):
+    df = df.filter(ODDS_FILE_COLUMNS)
+    df.columns = map(str.lower, df.columns)
+    df['winner'] = df['winner'].str.lower().str.strip()
+    df['loser'] = df['loser'].str.lower().str.strip()
+
+    # Odds are sometimes stored as text with thousands separators
+    for b in BROKERS:
+        for side in ['w', 'l']:
+            df[b + side] = to_odds(df[b + side])
+
+    return df
+
+
+def calc_odds(df):
+    # Best odds of the winner and the loser with their brokers and the mean winner to loser odds ratio, only brokers
+    # with odds for both players count. Computed on (matches x brokers) arrays at once.
+    odds_w = df[[b + 'w' for b in BROKERS]].to_numpy(dtype=np.float64)
+    odds_l = df[[b + 'l' for b in BROKERS]].to_numpy(dtype=np.float64)
+    valid = (odds_w > 0) & (odds_l > 0)
+    has_odds = valid.any(axis=1)
+
+    # The first broker wins ties
+    masked_w = np.where(valid, odds_w, -np.inf)
+    masked_l = np.where(valid, odds_l, -np.inf)
+    broker_w = np.argmax(masked_w, axis=1)
+    broker_l = np.argmax(masked_l, axis=1)
+    rows = np.arange(len(df))
+    ratio_sum = np.where(valid, odds_w / np.where(valid, odds_l, 1), 0).sum(axis=1)
+    brokers = np.array(BROKERS, dtype=object)
+
+    df = df.copy()
+
+    # A tourney starts with the date of the first match of a run of equal atp numbers
+    new_tourney = df['atp'].ne(df['atp'].shift()).to_numpy()
+    df['tourney_date'] = df['date'].where(new_tourney).ffill()
+
+    df['avg_ratio'] = np.where(has_odds, ratio_sum / np.maximum(valid.sum(axis=1), 1), np.nan)
+    df['max_w'] = np.where(has_odds, masked_w[rows, broker_w], np.nan)
+    df['max_l'] = np.where(has_odds, masked_l[rows, broker_l], np.nan)
+    df['broker_max_w'] = np.where(has_odds, brokers[broker_w], '')
+    df['broker_max_l'] = np.where(has_odds, brokers[broker_l], '')
+
+    return df
+
+
+def to_odds(column):
+    # Converts a column of numbers and text numbers to float, missing or unreadable odds are 0
+    if not pd.api.types.is_numeric_dtype(column):
+        column = pd.to_numeric(column.astype(str).str.replace(',', '', regex=False), errors='coerce')
+
+    return column.astype(np.float64).fillna(0)
+
+
+def prune_odds(df):
+    df = df.drop([b + side for b in BROKERS for side in ['w', 'l']], axis=1)
+    return df.dropna()
+
+
+def merge_player_ids(df, name_index, matches):
+    # Adds winner_id and loser_id to the odds by the player names, NaN if a player can not be resolved
+    # Names that fit several players are resolved with the ATP matches, the pair of candidates that played each
+    # other in a tournament starting on the same date is taken if there is exactly one
+    resolved = name_index.resolve_columns(df, ['winner', 'loser'])
+    winner_ids, winner_candidates = resolved['winner']
+    loser_ids, loser_candidates = resolved['loser']
+
+    ambiguous = np.flatnonzero(np.isnan(winner_ids) | np.isnan(loser_ids))
+    dates = df['tourney_date'].to_numpy().astype('datetime64[s]').astype(np.int64)
+    rows = []
+    winners = []
+    losers = []
+
+    for i in ambiguous:
+        for winner_id in winner_candidates[i]:
+            for loser_id in loser_candidates[i]:
+                rows.append(i)
+                winners.append(winner_id)
+                losers.append(loser_id)
+
+    pairs = pd.DataFrame({'row': rows, 'tourney_date': dates[rows] if len(rows) > 0 else [],
+                          'winner_id': winners, 'loser_id': losers}, columns=['row'] + MATCH_KEYS)
+    pairs = pairs.astype(np.int64)
+
+    match_keys = pd.DataFrame({
+        'tourney_date': matches['tourney_date'].to_numpy().astype('datetime64[s]').astype(np.int64),
+        'winner_id': matches['winner_id'].to_numpy(dtype=np.int64),
+        'loser_id': matches['loser_id'].to_numpy(dtype=np.int64)
+    }).drop_duplicates()
+
+    played = pairs.merge(match_keys, on=MATCH_KEYS, how='inner')
+    played = played.loc[~played.duplicated('row', keep=False)]
+
+    winner_ids[played['row'].to_numpy()] = played['winner_id'].to_numpy()
+    loser_ids[played['row'].to_numpy()] = played['loser_id'].to_numpy()
+
+    df = df.copy()
+    df['winner_id'] = winner_ids
+    df['loser_id'] = loser_ids
+
+    missed = np.isnan(winner_ids) | np.isnan(loser_ids)
+    print('Player ids merged for', round((1 - missed.mean()) * 100, 2), '% of the matches')
+    return df
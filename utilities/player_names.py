@@ -0,0 +1,108 @@
+# Resolves bookmaker player names like 'del potro j.m.' to ATP player ids
+import difflib
+import numpy as np
+import pandas as pd
+
+
+class PlayerNameIndex:
+    # Hash maps from fullname ('lastname f.m.') and from lastname to the ATP player ids carrying it, built once
+    # for all players. Names are looked up exactly by fullname, then by lastname and finally fuzzy within blocks
+    # of players sharing the first letter of the lastname and the initials. When a name fits several players,
+    # only the players active in the matched date range are kept.
+
+    def __init__(self, players, active_ids=None, cutoff=0.85):
+        player_ids = players['player_id'].to_numpy(dtype=np.int64)
+        lastnames = players['lastname'].fillna('').str.lower().str.replace('-', ' ').str.split().str.join(' ')
+        fullnames = get_fullnames(players['firstname'], lastnames)
+
+        self.fullnames = group_ids(fullnames, player_ids)
+        self.lastnames = group_ids(lastnames, player_ids)
+        self.active_ids = None if active_ids is None else set(np.asarray(active_ids, dtype=np.int64).tolist())
+        self.cutoff = cutoff
+
+        # Fuzzy matching only compares names within a block, active players only if known
+        self.blocks = {}
+
+        for fullname, ids in self.fullnames.items():
+            if self.active_ids is None or any(player_id in self.active_ids for player_id in ids):
+                self.blocks.setdefault(get_block(fullname), []).append(fullname)
+
+    def filter_active(self, ids):
+        # Keeps the active players of several candidates, unless none of them is active
+        if self.active_ids is None or len(ids) < 2:
+            return ids
+
+        active = [player_id for player_id in ids if player_id in self.active_ids]
+        return active if len(active) > 0 else ids
+
+    def resolve(self, name):
+        # Returns the candidate ids of a single name, empty if no player fits
+        name = normalize_name(name)
+        lastname, initials = split_name(name)
+        ids = self.fullnames.get(name)
+
+        if ids is None:
+            ids = self.lastnames.get(lastname)
+
+        # Compound lastnames are often only partly known, e.g. 'ramos vinolas a.' is 'ramos a.'
+        for part in sorted(lastname.split(), key=len, reverse=True):
+            if ids is not None:
+                break
+
+            ids = self.fullnames.get((part + ' ' + initials).strip(), self.lastnames.get(part))
+
+        if ids is None:
+            close = difflib.get_close_matches(name, self.blocks.get(get_block(name), []), n=1, cutoff=self.cutoff)
+            ids = self.fullnames[close[0]] if len(close) > 0 else []
+
+        return self.filter_active(ids)
+
+    def resolve_columns(self, df, columns):
+        # Resolves whole name columns in one pass, every distinct name is only looked up once
+        # Returns per column the resolved ids (NaN if not unique) and the candidate ids of every row
+        codes, names = pd.factorize(pd.concat([df[column] for column in columns], ignore_index=True))
+        candidates = [self.resolve(name) for name in names]
+        unique_ids = np.array([ids[0] if len(ids) == 1 else np.nan for ids in candidates], dtype=np.float64)
+
+        resolved = {}
+
+        for i, column in enumerate(columns):
+            column_codes = codes[i * len(df):(i + 1) * len(df)]
+            resolved[column] = (unique_ids[column_codes], [candidates[code] for code in column_codes])
+
+        return resolved
+
+
+def get_fullnames(firstnames, lastnames):
+    # Vectorized 'lastname f.m.' names of normalized lastnames, the initials are the first letters of all first names
+    initials = firstnames.fillna('').str.lower().str.findall(r'(?:^| )([^ ])').str.join('.')
+    dots = np.where(initials.str.len() > 0, '.', '')
+    return (lastnames + ' ' + initials + dots).str.strip()
+
+
+def normalize_name(name):
+    # Lowercase with hyphens as spaces and the initials joined, e.g. 'Zayid M. S.' is 'zayid m.s.'
+    lastname, initials = split_name(' '.join(str(name).lower().replace('-', ' ').split()))
+    return (lastname + ' ' + initials).strip()
+
+
+def split_name(name):
+    # Bookmaker names end with the initials, everything before them is the lastname
+    words = name.split()
+    initials = []
+
+    while len(words) > 1 and ('.' in words[-1] or len(words[-1]) == 1):
+        initials.insert(0, words.pop())
+
+    return ' '.join(words), ''.join(initials)
+
+
+def get_block(name):
+    # First letter of the lastname and the initials
+    return name[:1] + split_name(name)[1]
+
+
+def group_ids(names, player_ids):
+    # Hash map from name to the list of ids carrying it
+    groups = pd.Series(player_ids).groupby(names.to_numpy()).indices
+    return {name: player_ids[positions].tolist() for name, positions in groups.items() if len(name) > 0}
@@ -0,0 +1,191 @@
+# Array backed player statistics shared by stats.py and pre_processing.py
+import numpy as np
+import pandas as pd
+
+from utilities.hdf_store import write_table, PAIR_DATA_COLUMNS
+from utilities.schema import PAIR_SCHEMA, apply_schema
+
+COND_CAT = ['total_wins', 'total_losses', 'surface_clay_wins', 'surface_clay_losses', 'surface_grass_wins',
+            'surface_grass_losses', 'surface_hard_wins', 'surface_hard_losses', 'climate_tropical_dry_wins',
+            'climate_tropical_dry_losses', 'climate_tempered_wins', 'climate_tempered_losses']
+
+# Player pairs are hashed as a single integer key, player codes must fit in 32 bits
+PAIR_SHIFT = 32
+PAIR_MASK = (1 << PAIR_SHIFT) - 1
+
+
+class PlayerIndex:
+    # Maps ATP player ids to dense integer codes (row numbers in the arrays below)
+
+    def __init__(self, player_ids):
+        self.ids = np.asarray(player_ids, dtype=np.int64)
+        self.codes = {player_id: code for code, player_id in enumerate(self.ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, player_id):
+        return player_id in self.codes
+
+    def get_code(self, player_id):
+        return self.codes[player_id]
+
+    def add(self, player_id):
+        # Adds a player not seen before (e.g. when appending new matches) and returns its code
+        if player_id not in self.codes:
+            self.codes[player_id] = len(self.ids)
+            self.ids = np.append(self.ids, np.int64(player_id))
+
+        return self.codes[player_id]
+
+    def get_codes(self, player_ids):
+        # Vectorized lookup, returns the codes and a mask telling which ids are known
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+
+        if len(self.ids) == 0:
+            return np.zeros_like(player_ids), np.zeros(len(player_ids), dtype=bool)
+
+        sorter = np.argsort(self.ids, kind='mergesort')
+        pos = np.searchsorted(self.ids, player_ids, sorter=sorter)
+        codes = sorter[np.minimum(pos, len(self.ids) - 1)]
+        return codes, self.ids[codes] == player_ids
+
+
+class HeadToHeadStore:
+    # Sparse weighted head-to-head counts where get(a, b) is the weighted number of wins (or games) of a over b.
+    # Almost no pairs of players have ever met, so only non-zero pairs are kept in a hash of pair keys.
+
+    def __init__(self):
+        self.values = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, a, b):
+        return self.values.get(get_pair_key(a, b), 0)
+
+    def diff(self, a, b):
+        return self.values.get(get_pair_key(a, b), 0) - self.values.get(get_pair_key(b, a), 0)
+
+    def get_matrix(self, players):
+        # get(a, b) for all pairs of the given players, entry [i, j] is get(players[i], players[j])
+        players = np.asarray(players, dtype=np.int64)
+        keys = get_pair_key(players[:, np.newaxis], players[np.newaxis, :])
+        values = np.fromiter((self.values.get(key, 0) for key in keys.ravel().tolist()), dtype=np.int64,
+                             count=keys.size)
+        return values.reshape(keys.shape)
+
+    def add(self, a, b, weight):
+        key = get_pair_key(a, b)
+        self.values[key] = self.values.get(key, 0) + int(weight)
+
+    def add_many(self, a, b, weights):
+        # Sums duplicated pairs vectorized before they are merged into the hash
+        keys = get_pair_key(np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64))
+        keys, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=np.asarray(weights, dtype=np.float64), minlength=len(keys))
+
+        for key, weight in zip(keys.tolist(), sums.astype(np.int64).tolist()):
+            self.values[key] = self.values.get(key, 0) + weight
+
+    def to_coo(self, player_index):
+        # One row per non-zero pair with ATP player ids
+        keys = np.fromiter(self.values.keys(), dtype=np.int64, count=len(self.values))
+        weights = np.fromiter(self.values.values(), dtype=np.int64, count=len(self.values))
+        order = np.argsort(keys)
+        keys = keys[order]
+        return pd.DataFrame({'player': player_index.ids[keys >> PAIR_SHIFT],
+                             'opponent': player_index.ids[keys & PAIR_MASK],
+                             'value': weights[order]})
+
+    @classmethod
+    def from_coo(cls, frame, player_index):
+        store = cls()
+        players, players_in_index = player_index.get_codes(frame['player'].to_numpy())
+        opponents, opponents_in_index = player_index.get_codes(frame['opponent'].to_numpy())
+        mask = players_in_index & opponents_in_index
+        store.add_many(players[mask], opponents[mask], frame['value'].to_numpy()[mask])
+        return store
+
+    def to_frame(self, player_index):
+        # Dense version of the old HDF5 layout, frame[a][b] is the entry of column a and row b
+        no_players = len(player_index)
+        frame = np.zeros((no_players, no_players), dtype=np.int64)
+
+        for key, weight in self.values.items():
+            frame[key & PAIR_MASK, key >> PAIR_SHIFT] = weight
+
+        return pd.DataFrame(frame, player_index.ids, player_index.ids)
+
+    @classmethod
+    def from_frame(cls, frame, player_index):
+        store = cls()
+        rows, columns = np.nonzero(frame.to_numpy())
+        opponents, opponents_in_index = player_index.get_codes(frame.index.to_numpy()[rows])
+        players, players_in_index = player_index.get_codes(frame.columns.to_numpy()[columns])
+        mask = players_in_index & opponents_in_index
+        store.add_many(players[mask], opponents[mask], frame.to_numpy()[rows[mask], columns[mask]])
+        return store
+
+    def to_hdf(self, filepath, key, player_index, mode='a'):
+        # Table queryable by player and opponent, see hdf_store.query_head_to_head
+        write_table(apply_schema(self.to_coo(player_index), PAIR_SCHEMA), filepath, key, PAIR_DATA_COLUMNS, mode=mode)
+
+    @classmethod
+    def from_hdf(cls, filepath, key, player_index):
+        # Also reads statistics files written with the old dense layout
+        frame = pd.read_hdf(filepath, key=key)
+
+        if list(frame.columns) == ['player', 'opponent', 'value']:
+            return cls.from_coo(frame, player_index)
+
+        return cls.from_frame(frame, player_index)
+
+
+class ConditionalStats:
+    # Per player weighted wins and losses in total and conditioned on surface or climate
+
+    def __init__(self, no_players, columns=None):
+        self.columns = list(COND_CAT if columns is None else columns)
+        self.positions = {column: i for i, column in enumerate(self.columns)}
+        self.values = np.zeros((no_players, len(self.columns)), dtype=np.int64)
+
+    def resize(self, no_players):
+        # Adds empty rows for players added to the player index
+        if no_players > len(self.values):
+            extra = np.zeros((no_players - len(self.values), len(self.columns)), dtype=self.values.dtype)
+            self.values = np.vstack([self.values, extra])
+
+    def get(self, column, player):
+        return self.values[player, self.positions[column]]
+
+    def get_win_ratios(self, category, players):
+        # Won share of the played matches of several players in a category (e.g. 'total' or 'surface_clay'),
+        # 0 for players without matches
+        wins = self.values[players, self.positions[category + '_wins']].astype(np.float64)
+        played = wins + self.values[players, self.positions[category + '_losses']]
+        return np.divide(wins, played, out=np.zeros_like(wins), where=played != 0)
+
+    def add(self, column, player, weight):
+        self.values[player, self.positions[column]] += weight
+
+    def add_many(self, column, players, weights):
+        no_players = len(self.values)
+        weights = np.asarray(weights, dtype=np.float64)
+        self.values[:, self.positions[column]] += np.bincount(players, weights=weights,
+                                                              minlength=no_players).astype(np.int64)
+
+    def to_frame(self, player_index):
+        return pd.DataFrame(self.values.copy(), player_index.ids, self.columns)
+
+    @classmethod
+    def from_frame(cls, frame, player_index):
+        stats = cls(0, frame.columns)
+        frame = frame.reindex(index=player_index.ids, fill_value=0)
+        stats.values = frame.to_numpy(dtype=np.int64).copy()
+        return stats
+
+
+def get_pair_key(a, b):
+    # Works for both integer codes and arrays of codes
+    return (a << PAIR_SHIFT) | b
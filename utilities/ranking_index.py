@@ -0,0 +1,85 @@
+# Precomputed as-of lookup of ATP rankings, built once from helper.load_rankings()
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+# Dates are stored as days since epoch, shifted so that they fit in the lower 32 bits of a lookup key
+DATE_SHIFT = 32
+DATE_OFFSET = 1 << 31
+NS_PER_DAY = 24 * 60 * 60 * 10 ** 9
+
+
+class RankingIndex:
+    # Per player sorted ranking dates with aligned rank and points arrays
+
+    def __init__(self, rankings):
+        # Overlapping ranking lists contain duplicated dates, keep the first like the old lookup did
+        rankings = rankings.sort_values(by=['player', 'ranking_date'], kind='mergesort')
+        rankings = rankings.drop_duplicates(subset=['player', 'ranking_date'], keep='first')
+
+        self.player_ids, player_codes = np.unique(rankings['player'].to_numpy(dtype=np.int64), return_inverse=True)
+        self.dates = to_days(rankings['ranking_date'])
+        self.ranks = rankings['rank'].to_numpy(dtype=np.int64)
+        self.points = rankings['points'].fillna(0).to_numpy(dtype=np.float64)
+        self.keys = get_date_keys(player_codes, self.dates)
+
+        # Players without a ranking get the highest numbered ranking plus one
+        self.unranked = int(np.max(self.ranks)) + 1 if len(self.ranks) > 0 else 1
+
+        bounds = np.searchsorted(player_codes, np.arange(len(self.player_ids) + 1))
+        self.bounds = {player_id: (bounds[i], bounds[i + 1]) for i, player_id in enumerate(self.player_ids.tolist())}
+
+    def get(self, player_id, date):
+        # Rank and points as of date, i.e. from the latest ranking list published on or before date
+        start, end = self.bounds.get(player_id, (0, 0))
+        i = start + np.searchsorted(self.dates[start:end], to_days(date), side='right') - 1
+
+        if i < start:
+            return self.unranked, 0
+
+        return self.ranks[i], self.points[i]
+
+    def get_many(self, player_ids, dates):
+        # Batch version of get as a single as-of join over all (player, date) pairs
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+
+        if len(self.player_ids) == 0:
+            return np.full(len(player_ids), self.unranked, dtype=np.int64), np.zeros(len(player_ids))
+
+        codes = np.minimum(np.searchsorted(self.player_ids, player_ids), len(self.player_ids) - 1)
+        keys = get_date_keys(codes, to_days(dates))
+        i = np.searchsorted(self.keys, keys, side='right') - 1
+
+        # A hit must belong to the same player, otherwise the player was not ranked yet
+        found = (i >= 0) & (self.player_ids[codes] == player_ids)
+        found[found] = (self.keys[i[found]] >> DATE_SHIFT) == codes[found]
+
+        ranks = np.where(found, self.ranks[i], self.unranked)
+        points = np.where(found, self.points[i], 0)
+        return ranks, points
+
+    def get_rankings(self, winner_ids, loser_ids, tourney_dates):
+        # Rank differences and one year point gradient differences for all matches at once
+        tourney_dates = pd.Series(pd.to_datetime(tourney_dates))
+        last_year_dates = tourney_dates - pd.DateOffset(years=1)
+
+        winner_current_rank, winner_current_points = self.get_many(winner_ids, tourney_dates)
+        loser_current_rank, loser_current_points = self.get_many(loser_ids, tourney_dates)
+        _, winner_old_points = self.get_many(winner_ids, last_year_dates)
+        _, loser_old_points = self.get_many(loser_ids, last_year_dates)
+
+        rank_diff = winner_current_rank - loser_current_rank
+        points_grad_diff = (winner_current_points - winner_old_points) - (loser_current_points - loser_old_points)
+        return rank_diff, points_grad_diff
+
+
+def to_days(dates):
+    # Days since epoch for a single date or a column of dates
+    if isinstance(dates, (str, dt.date, np.datetime64)):
+        return pd.Timestamp(dates).value // NS_PER_DAY
+
+    return pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+
+def get_date_keys(player_codes, days):
+    return (np.asarray(player_codes, dtype=np.int64) << DATE_SHIFT) | (np.asarray(days, dtype=np.int64) + DATE_OFFSET)
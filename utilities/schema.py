@@ -0,0 +1,100 @@
+# Compact dtypes of the loaded raw files and the generated HDF5 files. Strings with few distinct values are
+# categoricals, ids fit in 32 bits, counters in 8 or 16 bits and features in 32 bit floats.
+import numpy as np
+import pandas as pd
+
+MATCH_SCHEMA = {
+    'tourney_id': 'category',
+    'tourney_name': 'category',
+    'tourney_level': 'category',
+    'surface': 'category',
+    'score': 'category',
+    'winner_ioc': 'category',
+    'loser_ioc': 'category',
+    'tourney_date': 'datetime64[ns]',
+    'winner_id': np.int32,
+    'loser_id': np.int32,
+    'match_num': np.int16,
+    'winner_age': np.float32,
+    'loser_age': np.float32,
+    'winner_games': np.int16,
+    'loser_games': np.int16
+}
+
+RANKING_SCHEMA = {
+    'ranking_date': 'datetime64[ns]',
+    'rank': np.int16,
+    'player': np.int32,
+    'points': np.float32
+}
+
+PLAYER_SCHEMA = {
+    'player_id': np.int32,
+    'country': 'category'
+}
+
+# Columns of the processed matches in file order, the others than COLS_NOT_SCALE are standardized
+DATA_COLUMNS = ['tourney_date', 'rel_total_wins', 'rel_surface_wins', 'mutual_wins', 'mutual_surface_wins',
+                'mutual_games', 'rank_diff', 'points_grad_diff', 'home_advantage', 'rel_climate_wins',
+                'rel_recent_wins', 'rel_tourney_games', 'tourney_level', 'player_1', 'player_2', 'surface',
+                'age_diff', 'outcome']
+COLS_NOT_SCALE = ['tourney_date', 'home_advantage', 'tourney_level', 'player_1', 'player_2', 'surface', 'outcome']
+
+# Processed matches, the date stays unix time in seconds and all scaled features are 32 bit floats
+PROCESSED_SCHEMA = {
+    'tourney_date': np.int64,
+    'rel_total_wins': np.float32,
+    'rel_surface_wins': np.float32,
+    'mutual_wins': np.float32,
+    'mutual_surface_wins': np.float32,
+    'mutual_games': np.float32,
+    'rank_diff': np.float32,
+    'points_grad_diff': np.float32,
+    'home_advantage': np.int8,
+    'rel_climate_wins': np.float32,
+    'rel_recent_wins': np.float32,
+    'rel_tourney_games': np.float32,
+    'tourney_level': np.int8,
+    'player_1': np.int32,
+    'player_2': np.int32,
+    'surface': np.int8,
+    'age_diff': np.float32,
+    'outcome': np.int8
+}
+
+# Generated statistics, weighted counts per player and per pair of players
+STATS_DTYPE = np.int32
+PAIR_SCHEMA = {
+    'player': np.int32,
+    'opponent': np.int32,
+    'value': np.int32
+}
+
+
+def get_categories(schema):
+    return [column for column, dtype in schema.items() if dtype == 'category']
+
+
+def apply_schema(df, schema):
+    # Casts the columns of the schema present in the frame, other columns are kept as they are
+    return df.astype({column: dtype for column, dtype in schema.items() if column in df.columns})
+
+
+def concat_frames(frames):
+    # pd.concat falls back to strings for categoricals with different categories, so all frames get the union
+    # of the categories first and only the integer codes are concatenated
+    frames = list(frames)
+
+    for column in frames[0].columns if len(frames) > 1 else []:
+        if not all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            continue
+
+        categories = frames[0][column].cat.categories
+
+        for frame in frames[1:]:
+            categories = categories.union(frame[column].cat.categories, sort=False)
+
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+
+    return pd.concat(frames, sort=False)
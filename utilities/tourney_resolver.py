@@ -0,0 +1,71 @@
+# Memoized tournament metadata lookup, replaces per match string filtering and scans of tourneys_fixed.csv
+import os
+import pandas as pd
+
+from definitions import GEN_PATH
+from utilities import helper as h
+
+# If climate unknown, assume tempered (maybe indoor)
+DEFAULT_CLIMATE = 'tempered'
+
+# A date up to this many days after the start of a tournament belongs to it
+TOURNEY_DAYS = 14
+
+
+class TourneyResolver:
+    # Maps tourney names to (location, climate, country_code), each distinct name is only resolved once.
+    # Also keeps the ids of the tournaments seen per name and start date, several tournaments share a name.
+
+    def __init__(self, tourneys=None):
+        if tourneys is None:
+            tourneys = pd.read_csv(os.path.join(GEN_PATH, 'tourneys_fixed.csv'), index_col=0)
+
+        # The first row of a location wins, like the previous .iloc[0] lookups
+        tourneys = tourneys.drop_duplicates(subset=['location'], keep='first').set_index('location')
+        self.climates = tourneys['climate'].to_dict()
+        self.country_codes = tourneys['country_code'].to_dict()
+        self.cache = {}
+        self.tourney_ids = {}
+
+    def resolve(self, tourney_name):
+        if tourney_name not in self.cache:
+            location = h.filter_tourney_name(tourney_name)
+            climate = self.climates.get(location, DEFAULT_CLIMATE)
+            country_code = self.country_codes.get(location)
+            self.cache[tourney_name] = (location, climate, country_code)
+
+        return self.cache[tourney_name]
+
+    def add_tourney(self, tourney_name, tourney_date, tourney_id):
+        self.tourney_ids.setdefault(tourney_name, {})[pd.Timestamp(tourney_date)] = tourney_id
+
+    def get_tourney_id(self, tourney_name, date):
+        # Id of the tournament with the name starting on date, otherwise of the latest one started at most
+        # TOURNEY_DAYS before date (a running tournament), None if there is none
+        date = pd.Timestamp(date)
+        starts = self.tourney_ids.get(tourney_name, {})
+
+        if date in starts:
+            return starts[date]
+
+        running = [start for start in starts if date - pd.Timedelta(days=TOURNEY_DAYS) < start <= date]
+        return starts[max(running)] if len(running) > 0 else None
+
+    def add_columns(self, matches):
+        # Adds categorical location, climate and country_code columns for all matches in one pass and
+        # remembers the tournament ids
+        if 'tourney_id' in matches.columns:
+            tourneys = matches[['tourney_name', 'tourney_date', 'tourney_id']].drop_duplicates()
+
+            for tourney in tourneys.itertuples():
+                self.add_tourney(tourney.tourney_name, tourney.tourney_date, tourney.tourney_id)
+
+        names = matches['tourney_name'].unique()
+        resolved = pd.DataFrame([self.resolve(name) for name in names], index=names,
+                                columns=['location', 'climate', 'country_code'])
+
+        for column in resolved.columns:
+            values = matches['tourney_name'].map(resolved[column])
+            matches[column] = pd.Categorical(values, categories=resolved[column].dropna().unique())
+
+        return matches
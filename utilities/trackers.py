@@ -0,0 +1,129 @@
+# Incremental state that is updated match by match in process_matches
+from collections import deque
+
+import pandas as pd
+
+
+class RecentFormTracker:
+    # Per player wins and played matches over a sliding window of recent months.
+    # Matches must be added in date order, expired matches are evicted from the front of the queue.
+
+    def __init__(self, months=3):
+        self.months = months
+        self.queue = deque()
+        self.wins = {}
+        self.played = {}
+
+        # Counts per tournament so that the current tournament can be excluded
+        self.tourney_matches = {}
+        self.tourney_wins = {}
+        self.tourney_played = {}
+
+        self.current_date = None
+
+    def add(self, tourney_date, tourney_id, winner_id, loser_id):
+        self.queue.append((tourney_date, tourney_id, winner_id, loser_id))
+        self.update(tourney_id, winner_id, loser_id, 1)
+
+    def advance(self, tourney_date):
+        # Evicts all matches older than the window, only needed when the date changes
+        if self.current_date is not None and tourney_date <= self.current_date:
+            return
+
+        self.current_date = tourney_date
+        date_limit = tourney_date - pd.DateOffset(months=self.months)
+
+        while len(self.queue) > 0 and self.queue[0][0] < date_limit:
+            _, tourney_id, winner_id, loser_id = self.queue.popleft()
+            self.update(tourney_id, winner_id, loser_id, -1)
+
+    def update(self, tourney_id, winner_id, loser_id, sign):
+        tourney_wins = self.tourney_wins.setdefault(tourney_id, {})
+        tourney_played = self.tourney_played.setdefault(tourney_id, {})
+
+        add_count(self.wins, winner_id, sign)
+        add_count(self.played, winner_id, sign)
+        add_count(self.played, loser_id, sign)
+        add_count(self.tourney_matches, tourney_id, sign)
+        add_count(tourney_wins, winner_id, sign)
+        add_count(tourney_played, winner_id, sign)
+        add_count(tourney_played, loser_id, sign)
+
+        # Tournaments that have left the window are dropped
+        if tourney_id not in self.tourney_matches:
+            del self.tourney_wins[tourney_id]
+            del self.tourney_played[tourney_id]
+
+    def get_form(self, player_id, tourney_id):
+        # Wins and played matches in the window, not counting the given tournament
+        wins = self.wins.get(player_id, 0)
+        played = self.played.get(player_id, 0)
+
+        if tourney_id in self.tourney_matches:
+            wins -= self.tourney_wins[tourney_id].get(player_id, 0)
+            played -= self.tourney_played[tourney_id].get(player_id, 0)
+
+        return wins, played
+
+
+def add_count(counts, key, value):
+    # Adds to a counter dictionary and removes keys that reach zero to keep the state small
+    count = counts.get(key, 0) + value
+
+    if count == 0:
+        counts.pop(key, None)
+    else:
+        counts[key] = count
+
+
+class TourneyGamesTracker:
+    # Running game differential and match count per player for the tournaments currently played.
+    # Matches must be added in (tourney_date, match_num) order.
+
+    def __init__(self):
+        self.games = {}
+        self.dates = {}
+        self.pending = []
+        self.current_key = None
+
+    def add(self, tourney_date, tourney_id, winner_id, loser_id, diff_games):
+        self.pending.append((tourney_date, tourney_id, winner_id, loser_id, diff_games))
+
+    def advance(self, tourney_date, match_num=None):
+        # Matches only count for later match numbers, so added matches are applied when the match number changes.
+        # Without a match number (upcoming matches) all added matches are applied.
+        # Tournaments from earlier dates are over and dropped.
+        key = (tourney_date, match_num)
+
+        if key == self.current_key and match_num is not None:
+            return
+
+        if self.current_key is not None and tourney_date > self.current_key[0]:
+            for tourney_id in [t for t, date in self.dates.items() if date < tourney_date]:
+                del self.games[tourney_id]
+                del self.dates[tourney_id]
+
+        self.current_key = key
+
+        for pending_date, tourney_id, winner_id, loser_id, diff_games in self.pending:
+            if pending_date < tourney_date:
+                continue
+
+            # Note that I am accounting for round robin match types here, e.g. ATP finals
+            tourney_games = self.games.setdefault(tourney_id, {})
+            self.dates[tourney_id] = pending_date
+            add_games(tourney_games, winner_id, diff_games)
+
+            if loser_id != winner_id:
+                add_games(tourney_games, loser_id, -diff_games)
+
+        self.pending = []
+
+    def get_games(self, player_id, tourney_id):
+        # Game differential and number of matches played so far in the tournament
+        return self.games.get(tourney_id, {}).get(player_id, (0, 0))
+
+
+def add_games(tourney_games, player_id, diff_games):
+    diff, no_matches = tourney_games.get(player_id, (0, 0))
+    tourney_games[player_id] = (diff + diff_games, no_matches + 1)